@@ -0,0 +1,39 @@
+"""
+Striped account locking for the UPI Payment Gateway System
+"""
+
+import threading
+from contextlib import contextmanager
+
+# Number of locks the accounts are spread over
+DEFAULT_STRIPES = 1024
+
+class AccountLockManager:
+    """
+    Fixed set of locks shared by all accounts.
+
+    Each account maps to one of `stripes` locks by the hash of its ID, so
+    memory stays constant however many accounts exist. A payment locks
+    the stripes of both of its accounts, always in ascending stripe order,
+    so two payments can never wait on each other in a cycle. Payments
+    whose accounts fall on different stripes run in parallel.
+    """
+    def __init__(self, stripes=DEFAULT_STRIPES):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def _stripe(self, account_id):
+        """Get the stripe number of an account"""
+        return hash(account_id) % len(self._locks)
+
+    @contextmanager
+    def locked(self, *account_ids):
+        """Hold the locks of all given accounts for the duration of a with block"""
+        stripes = sorted({self._stripe(account_id) for account_id in account_ids})
+
+        for stripe in stripes:
+            self._locks[stripe].acquire()
+        try:
+            yield
+        finally:
+            for stripe in reversed(stripes):
+                self._locks[stripe].release()
@@ -0,0 +1,229 @@
+"""
+Write-ahead log and snapshot storage for bank accounts
+"""
+
+import json
+import os
+import threading
+import time
+
+# Number of logged mutations after which a background snapshot is taken
+DEFAULT_SNAPSHOT_INTERVAL = 10000
+
+class AccountStore:
+    """
+    Durable storage for user and merchant accounts.
+
+    Every registration or balance change is appended to a write-ahead log
+    as a single record holding the full account. Periodically the accounts
+    are compacted into snapshot files (users.json and merchants.json) in a
+    background thread and the log files covered by the snapshot are removed.
+    Recovery loads the latest snapshot and replays the log tail. Records
+    carry absolute account state, so replaying a record that is already
+    part of the snapshot is harmless.
+
+    Payment responses stored for idempotency keys are logged the same way
+    and snapshotted to idempotency_keys.json; expired ones are dropped at
+    each snapshot.
+    """
+    def __init__(self, users_file="users.json", merchants_file="merchants.json",
+                 wal_dir="account_wal", snapshot_interval=DEFAULT_SNAPSHOT_INTERVAL,
+                 idempotency_file="idempotency_keys.json"):
+        self.files = {"users": users_file, "merchants": merchants_file, "idempotency": idempotency_file}
+        self.wal_dir = wal_dir
+        self.meta_path = os.path.join(wal_dir, "snapshot.json")
+        self.snapshot_interval = snapshot_interval
+
+        self.tables = {"users": {}, "merchants": {}, "idempotency": {}}
+        self.mmids = {}  # mmid -> user_id
+        self.generation = 0  # Generation of the active log file
+        self.records_since_snapshot = 0
+
+        self._wal_file = None
+        self._lock = threading.Lock()
+        self._snapshot_thread = None
+
+        os.makedirs(wal_dir, exist_ok=True)
+
+    def _wal_path(self, generation):
+        """Get the path of the log file for a generation"""
+        return os.path.join(self.wal_dir, f"wal_{generation:08d}.log")
+
+    def _wal_generations(self):
+        """List the generations of the log files on disk"""
+        generations = []
+        for file_name in os.listdir(self.wal_dir):
+            if file_name.startswith("wal_") and file_name.endswith(".log"):
+                generations.append(int(file_name[4:-4]))
+        return sorted(generations)
+
+    def load(self):
+        """Recover accounts from the latest snapshot and the log tail"""
+        for table, file_name in self.files.items():
+            if os.path.exists(file_name):
+                with open(file_name, "r") as f:
+                    self.tables[table] = json.load(f)
+
+        snapshot_generation = 0
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r") as f:
+                snapshot_generation = json.load(f)["generation"]
+
+        # Replay every log written since the snapshot was started
+        replayed = 0
+        generations = [g for g in self._wal_generations() if g >= snapshot_generation]
+        for generation in generations:
+            replayed += self._replay(self._wal_path(generation), repair=generation == generations[-1])
+
+        if replayed:
+            print(f"Replayed {replayed} account log records")
+
+        self.generation = generations[-1] if generations else snapshot_generation
+        self.records_since_snapshot = replayed
+        self._wal_file = open(self._wal_path(self.generation), "ab")
+
+        self.mmids = {user["mmid"]: uid for uid, user in self.tables["users"].items() if "mmid" in user}
+
+        return self.tables["users"], self.tables["merchants"]
+
+    def _replay(self, path, repair=False):
+        """Apply the records of one log file, truncating a torn trailing record if repair is set"""
+        count = 0
+        good_offset = 0
+
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Partially written record from an interrupted append
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self.tables[record["table"]][record["key"]] = record["value"]
+                good_offset += len(line)
+                count += 1
+
+        if repair and good_offset != os.path.getsize(path):
+            print(f"Repairing torn record in account log {path}")
+            with open(path, "r+b") as f:
+                f.truncate(good_offset)
+
+        return count
+
+    def log_user(self, uid, user):
+        """Log the current state of a user account"""
+        if "mmid" in user:
+            self.mmids[user["mmid"]] = uid
+        self._append("users", uid, user)
+
+    def find_uid(self, mmid):
+        """Get the ID of the user with an MMID, or None"""
+        return self.mmids.get(mmid)
+
+    def log_merchant(self, mid, merchant):
+        """Log the current state of a merchant account"""
+        self._append("merchants", mid, merchant)
+
+    def log_idempotency(self, key, response, expires):
+        """Log the response of a payment made with an idempotency key, kept until expires"""
+        entry = {"response": response, "expires": expires}
+        self.tables["idempotency"][key] = entry
+        self._append("idempotency", key, entry)
+
+    def idempotency_entries(self):
+        """Get the stored payment responses that have not expired, as key -> {response, expires}"""
+        now = time.time()
+        return {key: entry for key, entry in self.tables["idempotency"].items() if entry["expires"] > now}
+
+    def _append(self, table, key, value):
+        """Append one mutation record to the log"""
+        record = json.dumps({"table": table, "key": key, "value": value}).encode() + b"\n"
+
+        with self._lock:
+            self._wal_file.write(record)
+            self._wal_file.flush()
+            self.records_since_snapshot += 1
+            due = self.records_since_snapshot >= self.snapshot_interval
+
+        if due:
+            self.snapshot(background=True)
+
+    def flush(self):
+        """Flush buffered log records to the operating system"""
+        with self._lock:
+            if self._wal_file is not None:
+                self._wal_file.flush()
+
+    def sync(self):
+        """Flush and fsync the log so logged mutations are durable"""
+        with self._lock:
+            if self._wal_file is not None:
+                self._wal_file.flush()
+                os.fsync(self._wal_file.fileno())
+
+    def snapshot(self, background=False):
+        """Write a compacted snapshot of all accounts and drop the covered logs"""
+        with self._lock:
+            if self._snapshot_thread is not None and self._snapshot_thread.is_alive():
+                if background:
+                    return
+                self._snapshot_thread.join()
+
+            # Start a new log generation; records logged from here on are
+            # replayed on top of this snapshot
+            self._wal_file.flush()
+            os.fsync(self._wal_file.fileno())
+            self._wal_file.close()
+            self.generation += 1
+            self._wal_file = open(self._wal_path(self.generation), "ab")
+            self.records_since_snapshot = 0
+
+            # Stored payment responses are only needed until they expire
+            now = time.time()
+            idempotency = self.tables["idempotency"]
+            for key in [key for key, entry in idempotency.items() if entry["expires"] <= now]:
+                del idempotency[key]
+
+            generation = self.generation
+            tables = {table: dict(accounts) for table, accounts in self.tables.items()}
+
+        if background:
+            self._snapshot_thread = threading.Thread(target=self._write_snapshot, args=(tables, generation))
+            self._snapshot_thread.daemon = True
+            self._snapshot_thread.start()
+        else:
+            self._write_snapshot(tables, generation)
+
+    def _write_snapshot(self, tables, generation):
+        """Write snapshot files, then record the generation and remove older logs"""
+        try:
+            for table, accounts in tables.items():
+                # Copy each account so concurrent updates can't change it mid-dump
+                accounts = {key: dict(value) for key, value in accounts.items()}
+                self._atomic_write_json(self.files[table], accounts)
+
+            self._atomic_write_json(self.meta_path, {"generation": generation})
+
+            for old_generation in self._wal_generations():
+                if old_generation < generation:
+                    os.remove(self._wal_path(old_generation))
+        except Exception as e:
+            print(f"Error writing account snapshot: {e}")
+
+    def _atomic_write_json(self, path, data):
+        """Write JSON to a temporary file and move it into place"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def close(self):
+        """Wait for a running snapshot and close the log"""
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+        with self._lock:
+            if self._wal_file is not None:
+                self._wal_file.close()
+                self._wal_file = None
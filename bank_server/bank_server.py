@@ -2,13 +2,19 @@
 Bank Server Implementation for UPI Payment Gateway System
 """
 
+import asyncio
+import heapq
 import json
+import secrets
 import socket
 import threading
 import time
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
 from datetime import datetime
+from itertools import islice
 
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -16,10 +22,21 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from common_utils import ( # type: ignore
     generate_merchant_id, generate_user_id, generate_mmid, 
     HOST, PORT_BANK, PORT_UPI_MACHINE, PORT_USER,
-    send_message, get_bank_from_ifsc, BANKS, SPECK,
-    simulate_quantum_attack
+    send_message, get_bank_from_ifsc, BANKS,
+    simulate_quantum_attack, BANK_SETTINGS, TTLCache, SpeckBatchDecryptor, SpeckCache
 )
-from blockchain import Blockchain # type: ignore
+from blockchain import Blockchain, verify_chains_parallel # type: ignore
+from ledger_store import SegmentedLedgerStore # type: ignore
+from storage_backend import create_storage_backend, SQLiteStorageBackend # type: ignore
+from group_commit import GroupCommitter # type: ignore
+from account_locks import AccountLockManager # type: ignore
+from protocol import ( # type: ignore
+    serve_connection, read_frame, encode_frame, CONNECTION_IDLE_TIMEOUT
+)
+
+# Accounts examined per list_merchants / list_users request; with filters a
+# page may come back short, and the client continues from next_cursor
+LIST_SCAN_LIMIT = 10000
 
 class BankServer:
     """Bank Server Implementation"""
@@ -27,48 +44,111 @@ class BankServer:
         # Initialize bank data
         self.merchants = {}  # merchant_id -> merchant_data
         self.users = {}  # user_id -> user_data
-        self.mmid_to_uid = {}  # mmid -> user_id mapping
         
-        # Initialize blockchains for each bank
+        # Account IDs in registration order, for paging through accounts
+        self.merchant_ids = []
+        self.user_ids = []
+        
+        # VMIDs handed out by generate_vmid -> merchant_id, so a payment can
+        # find its merchant with one lookup
+        self.vmid_index = TTLCache(
+            max_size=BANK_SETTINGS.get("vmid_index_size", 100000),
+            ttl=BANK_SETTINGS.get("vmid_ttl_s", 86400)
+        )
+        self.merchant_decryptor = None  # SPECK keys of all merchants, see resolve_vmid()
+        
+        # Responses of payments made with an idempotency key, replayed to
+        # retries instead of charging again; also kept in the account store
+        self.idempotency_cache = TTLCache(
+            max_size=BANK_SETTINGS.get("idempotency_cache_size", 100000),
+            ttl=BANK_SETTINGS.get("idempotency_ttl_s", 86400)
+        )
+        # Idempotency keys of payments applied but not yet committed
+        self.committing_keys = set()
+        
+        # Session tokens issued by login() -> user_id
+        self.sessions = TTLCache(
+            max_size=BANK_SETTINGS.get("session_cache_size", 100000),
+            ttl=BANK_SETTINGS.get("session_ttl_s", 900)
+        )
+        
+        # Prepared SPECK ciphers of recently used merchant IDs
+        self.cipher_cache = SpeckCache(BANK_SETTINGS.get("cipher_cache_size", 4096))
+        
+        # Accounts and blockchains are kept in JSON files or in SQLite
+        self.storage = create_storage_backend(BANK_SETTINGS)
+        self.account_store = self.storage.open_account_store()
+        
+        # Locks serializing balance changes per account
+        self.account_locks = AccountLockManager(BANK_SETTINGS.get("account_lock_stripes", 1024))
+        
+        # Initialize blockchains for each bank; block_size > 1 seals
+        # payments into Merkle batch blocks
+        block_size = BANK_SETTINGS.get("block_size", 1)
+        seal_interval = BANK_SETTINGS.get("block_seal_interval_ms", 500) / 1000
         self.blockchains = {
-            "HDFC": Blockchain("HDFC"),
-            "ICICI": Blockchain("ICICI"),
-            "SBI": Blockchain("SBI")
+            "HDFC": Blockchain("HDFC", block_size, seal_interval),
+            "ICICI": Blockchain("ICICI", block_size, seal_interval),
+            "SBI": Blockchain("SBI", block_size, seal_interval)
         }
+        # Timestamp of the newest transaction on each chain
+        self.chain_timestamps = {bank_name: 0.0 for bank_name in self.blockchains}
         
         # Initialize server socket
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind(('0.0.0.0', PORT_BANK))
-        self.server_socket.listen(5)
+        self.server_socket.listen(BANK_SETTINGS.get("listen_backlog", 5))
         
         print(f"Bank Server started on {HOST}:{PORT_BANK}")
         
         # Load data if exists
         self.load_data()
         
+        # Batch concurrent writers into one durable flush
+        self.group_commit = GroupCommitter(
+            self.sync_storage,
+            window=BANK_SETTINGS.get("group_commit_window_ms", 2) / 1000,
+            max_batch=BANK_SETTINGS.get("group_commit_max_batch", 64)
+        )
+        
+        # Seal partially filled batch blocks once they are old enough
+        if block_size > 1:
+            self.sealer_thread = threading.Thread(target=self.run_block_sealer, args=(seal_interval,))
+            self.sealer_thread.daemon = True
+            self.sealer_thread.start()
+        
         # Start server thread
         self.server_thread = threading.Thread(target=self.start_server)
         self.server_thread.daemon = True
         self.server_thread.start()
     
+    def run_block_sealer(self, seal_interval):
+        """Seal batch blocks that reached the time threshold"""
+        while True:
+            time.sleep(seal_interval / 2)
+            try:
+                sealed = [blockchain.seal_if_due() for blockchain in self.blockchains.values()]
+                if any(sealed):
+                    self.group_commit.commit()
+            except Exception as e:
+                print(f"Error sealing blocks: {e}")
+    
     def load_data(self):
-        """Load bank data from files if they exist"""
+        """Load bank data from the latest snapshot and write-ahead log"""
         try:
-            if os.path.exists("merchants.json"):
-                with open("merchants.json", "r") as f:
-                    self.merchants = json.load(f)
-                print(f"Loaded {len(self.merchants)} merchants")
+            self.users, self.merchants = self.account_store.load()
+            print(f"Loaded {len(self.merchants)} merchants")
+            print(f"Loaded {len(self.users)} users")
             
-            if os.path.exists("users.json"):
-                with open("users.json", "r") as f:
-                    self.users = json.load(f)
-                print(f"Loaded {len(self.users)} users")
-                
-                # Rebuild mmid_to_uid mapping
-                for uid, user_data in self.users.items():
-                    if "mmid" in user_data:
-                        self.mmid_to_uid[user_data["mmid"]] = uid
+            # Restore the stored responses of recent payments
+            now = time.time()
+            entries = self.account_store.idempotency_entries()
+            for key, entry in sorted(entries.items(), key=lambda item: item[1]["expires"]):
+                self.idempotency_cache.set(key, entry["response"], ttl=entry["expires"] - now)
+            
+            self.merchant_ids = list(self.merchants)
+            self.user_ids = list(self.users)
             
             # Also load blockchain data
             self.load_blockchain_data()
@@ -76,13 +156,11 @@ class BankServer:
             print(f"Error loading data: {e}")
     
     def save_data(self):
-        """Save bank data to files"""
+        """Write a compacted snapshot of bank data to files"""
         try:
-            with open("merchants.json", "w") as f:
-                json.dump(self.merchants, f, indent=2)
-            
-            with open("users.json", "w") as f:
-                json.dump(self.users, f, indent=2)
+            # Account changes are already in the write-ahead log, so this
+            # only folds them into users.json and merchants.json
+            self.account_store.snapshot()
             
             # Also save blockchain data
             self.save_blockchain_data()
@@ -91,42 +169,63 @@ class BankServer:
         except Exception as e:
             print(f"Error saving data: {e}")
     
+    def sync_storage(self):
+        """Make everything logged so far durable (called once per commit batch)"""
+        self.storage.sync()
+    
+    def commit(self):
+        """Wait until this thread's writes are durable, returning an error response on failure"""
+        try:
+            self.group_commit.commit()
+        except IOError as e:
+            return {"status": "error", "message": str(e)}
+        return None
+    
     def save_blockchain_data(self):
-        """Save blockchain data to files"""
+        """Flush blockchain data to disk"""
         try:
-            # Create directory if it doesn't exist
-            if not os.path.exists("blockchain_data"):
-                os.makedirs("blockchain_data")
-            
-            # Save blockchain data for each bank
-            for bank_name, blockchain in self.blockchains.items():
-                filename = f"blockchain_data/{bank_name}_blockchain.json"
-                with open(filename, "w") as f:
-                    # Serialize blockchain data
-                    chain_data = [block.serialize() for block in blockchain.chain]
-                    json.dump(chain_data, f, indent=2)
+            # Blocks are appended to the ledger segments as they are added,
+            # so only buffered records need to be flushed here
+            for blockchain in self.blockchains.values():
+                if blockchain.store is not None:
+                    blockchain.store.flush()
             
             print("Blockchain data saved successfully")
         except Exception as e:
             print(f"Error saving blockchain data: {e}")
     
     def load_blockchain_data(self):
-        """Load blockchain data from files"""
+        """Load blockchain data from the storage backend"""
         try:
-            # Check if blockchain_data directory exists
+            # Create directory if it doesn't exist
             if not os.path.exists("blockchain_data"):
-                print("No blockchain data found")
-                return
+                os.makedirs("blockchain_data")
             
             # Load blockchain data for each bank
-            for bank_name in self.blockchains.keys():
-                filename = f"blockchain_data/{bank_name}_blockchain.json"
-                if os.path.exists(filename):
-                    with open(filename, "r") as f:
-                        chain_data = json.load(f)
-                        # Deserialize and rebuild blockchain
-                        self.blockchains[bank_name].rebuild_chain(chain_data)
-                    print(f"Loaded blockchain for {bank_name}")
+            for bank_name, blockchain in self.blockchains.items():
+                store = self.storage.open_ledger_store(bank_name)
+                
+                ledger_dir = os.path.join("blockchain_data", bank_name)
+                legacy_filename = f"blockchain_data/{bank_name}_blockchain.json"
+                
+                if store.is_empty() and not isinstance(store, SegmentedLedgerStore) and \
+                        os.path.exists(os.path.join(ledger_dir, "index.json")):
+                    # Import a chain kept in the JSON ledger files
+                    json_store = SegmentedLedgerStore(ledger_dir)
+                    blockchain.attach_store(json_store)
+                    json_store.close()
+                    print(f"Importing {ledger_dir} into {self.storage.name} ledger storage")
+                elif store.is_empty() and os.path.exists(legacy_filename):
+                    # Import a chain saved in the old single-file format
+                    with open(legacy_filename, "r") as f:
+                        blockchain.rebuild_chain(json.load(f))
+                    print(f"Migrating {legacy_filename} to {self.storage.name} ledger storage")
+                
+                # SQLite indexes the transactions, so only the chain tip needs to be in memory
+                lazy = BANK_SETTINGS.get("lazy_ledger", self.storage.name == SQLiteStorageBackend.name)
+                blockchain.attach_store(store, lazy=lazy)
+                self.chain_timestamps[bank_name] = blockchain.get_latest_block().timestamp
+                print(f"Loaded blockchain for {bank_name} ({len(blockchain.chain)} blocks)")
         except Exception as e:
             print(f"Error loading blockchain data: {e}")
     
@@ -156,8 +255,13 @@ class BankServer:
             "created_at": timestamp
         }
         
-        # Save data
-        self.save_data()
+        self.merchant_ids.append(mid)
+        
+        # Log the new account
+        self.account_store.log_merchant(mid, self.merchants[mid])
+        error = self.commit()
+        if error:
+            return error
         
         return {
             "status": "success", 
@@ -197,11 +301,13 @@ class BankServer:
             "created_at": timestamp
         }
         
-        # Update MMID to UID mapping
-        self.mmid_to_uid[mmid] = uid
+        self.user_ids.append(uid)
         
-        # Save data
-        self.save_data()
+        # Log the new account
+        self.account_store.log_user(uid, self.users[uid])
+        error = self.commit()
+        if error:
+            return error
         
         return {
             "status": "success", 
@@ -210,30 +316,61 @@ class BankServer:
             "mmid": mmid
         }
     
-    def process_transaction(self, data):
-        """Process a transaction from UPI machine"""
-        required_fields = ["mid", "mmid", "amount", "pin"]
+    def _validate_payment(self, data):
+        """
+        Check a payment request's fields, MMID, PIN and merchant
+        
+        Returns (error, uid, user, merchant, amount) where error is an error
+        response, or None if the payment may go ahead.
+        """
+        # The user is identified by a session token, or by MMID and PIN
+        required_fields = ["mid", "amount"] if "token" in data else ["mid", "mmid", "amount", "pin"]
         for field in required_fields:
             if field not in data:
-                return {"status": "error", "message": f"Missing required field: {field}"}
-        
-        # Get user ID from MMID
-        uid = self.mmid_to_uid.get(data["mmid"])
-        if not uid:
-            return {"status": "error", "message": "Invalid MMID"}
+                return {"status": "error", "message": f"Missing required field: {field}"}, None, None, None, None
         
-        # Verify PIN
-        user = self.users.get(uid)
-        if not user or user["pin"] != data["pin"]:
-            return {"status": "error", "message": "Invalid PIN"}
+        error, uid, user = self.authenticate_user(data.get("token"), data.get("mmid"), data.get("pin"))
+        if error:
+            return error, None, None, None, None
         
         # Check if merchant exists
         merchant = self.merchants.get(data["mid"])
         if not merchant:
-            return {"status": "error", "message": "Invalid Merchant ID"}
+            return {"status": "error", "message": "Invalid Merchant ID"}, None, None, None, None
+        
+        try:
+            amount = float(data["amount"])
+        except (TypeError, ValueError):
+            return {"status": "error", "message": "Invalid amount"}, None, None, None, None
+        
+        return None, uid, user, merchant, amount
+    
+    def _receipt_summary(self, receipts):
+        """
+        Reduce per-bank chain receipts to what is returned to the client
+        
+        The block hash is included once the block is sealed, so the client
+        can later check an inclusion proof against it.
+        """
+        return {
+            bank: {key: receipt[key] for key in ("block_index", "leaf_index", "sealed", "block_hash")
+                   if key in receipt}
+            for bank, receipt in receipts.items()
+        }
+    
+    def process_transaction(self, data):
+        """Process a transaction from UPI machine"""
+        error, uid, user, merchant, amount = self._validate_payment(data)
+        if error:
+            return error
+        
+        # A retry of a payment that was already processed gets the same response
+        idempotency_key = self._idempotency_key(uid, data)
+        replayed = self._replayed_response(idempotency_key)
+        if replayed:
+            return replayed
         
         # Check if user has sufficient balance
-        amount = float(data["amount"])
         if user["balance"] < amount:
             return {"status": "error", "message": "Insufficient balance"}
         
@@ -243,36 +380,88 @@ class BankServer:
             attack_success = simulate_quantum_attack(user["pin"], uid)
             # If simulating, still proceed with transaction
         
+        # Lock both accounts so concurrent payments can't lose updates, and
+        # keep the payment's writes together in one storage transaction
+        with self.account_locks.locked(uid, data["mid"]), self.storage.transaction():
+            # A retry may have overtaken its first attempt before the lock
+            replayed = self._replayed_response(idempotency_key)
+            if replayed:
+                return replayed
+            if idempotency_key in self.committing_keys:
+                return self._still_committing_error()
+            
+            response = self._apply_payment(uid, user, data["mid"], merchant, amount)
+            if response["status"] != "success":
+                return response
+            self._log_response(idempotency_key, response)
+        
+        # Only report success once the payment is durable (outside the
+        # account locks so concurrent payments share one group commit)
+        error = self.commit()
+        self._settle_payments([(idempotency_key, response, uid, user, data["mid"], merchant, amount)], error)
+        if error:
+            return error
+        
+        return response
+    
+    @contextmanager
+    def chains_locked(self, *banks):
+        """Hold the append locks of the given banks' chains, taken in a fixed order"""
+        with ExitStack() as stack:
+            for bank in sorted(set(banks)):
+                stack.enter_context(self.blockchains[bank].lock)
+            yield
+    
+    def _next_timestamp(self, *banks):
+        """
+        Get a timestamp for a transaction on the given banks' chains (chain locks held)
+        
+        Timestamps are taken under the chain locks and never go backwards,
+        so every chain lists its transactions in timestamp order and
+        transaction IDs stay unique.
+        """
+        timestamp = max([time.time()] + [self.chain_timestamps[bank] + 1e-6 for bank in banks])
+        for bank in banks:
+            self.chain_timestamps[bank] = timestamp
+        return timestamp
+    
+    def _apply_payment(self, uid, user, mid, merchant, amount):
+        """Move the money, record the transaction and log both accounts (account locks held)"""
+        # Check again now that no other payment can change the balance
+        if user["balance"] < amount:
+            return {"status": "error", "message": "Insufficient balance"}
+        
         # Process the transaction
         user["balance"] -= amount
         merchant["balance"] += amount
         
-        # Create transaction record
-        timestamp = time.time()
-        transaction_id = f"{uid}_{data['mid']}_{timestamp}"
-        transaction_data = {
-            "transaction_id": transaction_id,
-            "from_user": uid,
-            "to_merchant": data["mid"],
-            "amount": amount,
-            "timestamp": timestamp,
-            "user_bank": user["bank"],
-            "merchant_bank": merchant["bank"]
-        }
-        
-        # Add transaction to blockchain
         user_bank = user["bank"]
         merchant_bank = merchant["bank"]
         
-        # Add to user's bank blockchain
-        self.blockchains[user_bank].add_transaction(transaction_data)
-        
-        # If merchant is in a different bank, add to merchant's bank blockchain too
-        if user_bank != merchant_bank:
-            self.blockchains[merchant_bank].add_transaction(transaction_data)
+        with self.chains_locked(user_bank, merchant_bank):
+            # Create transaction record
+            timestamp = self._next_timestamp(*{user_bank, merchant_bank})
+            transaction_id = f"{uid}_{mid}_{timestamp}"
+            transaction_data = {
+                "transaction_id": transaction_id,
+                "from_user": uid,
+                "to_merchant": mid,
+                "amount": amount,
+                "timestamp": timestamp,
+                "user_bank": user_bank,
+                "merchant_bank": merchant_bank
+            }
+            
+            # Add to user's bank blockchain
+            receipts = {user_bank: self.blockchains[user_bank].add_transaction(transaction_data)}
+            
+            # If merchant is in a different bank, add to merchant's bank blockchain too
+            if user_bank != merchant_bank:
+                receipts[merchant_bank] = self.blockchains[merchant_bank].add_transaction(transaction_data)
         
-        # Save updated data
-        self.save_data()
+        # Log the updated balances
+        self.account_store.log_user(uid, user)
+        self.account_store.log_merchant(mid, merchant)
         
         return {
             "status": "success",
@@ -281,7 +470,261 @@ class BankServer:
             "amount": amount,
             "timestamp": timestamp,
             "user_balance": user["balance"],
-            "merchant_balance": merchant["balance"]
+            "merchant_balance": merchant["balance"],
+            "receipts": self._receipt_summary(receipts)
+        }
+    
+    def _idempotency_key(self, uid, data):
+        """Get the replay cache key of a payment, or None if it carries no idempotency key"""
+        if data.get("idempotency_key") is None:
+            return None
+        # Keys are per user so one user's key can't replay another's payment
+        return f"{uid}:{data['idempotency_key']}"
+    
+    def _log_response(self, key, response):
+        """
+        Store a payment's response with the payment's own writes (account locks held)
+        
+        The response only becomes replayable in _settle_payments() once the
+        commit succeeded; until then retries with the key are turned away.
+        """
+        if key is None:
+            return
+        self.committing_keys.add(key)
+        self.account_store.log_idempotency(key, response, time.time() + self.idempotency_cache.ttl)
+    
+    def _still_committing_error(self):
+        """Response to a retry that arrives while its first attempt is being committed"""
+        return {"status": "error", "message": "A payment with this idempotency key is still being processed"}
+    
+    def _settle_payments(self, payments, error):
+        """
+        Finish payments applied in memory once their commit is done
+        
+        payments holds (idempotency_key, response, uid, user, mid, merchant,
+        amount) of each applied payment. After a successful commit the
+        responses are cached for retries. If the commit failed the balance
+        changes are undone and the stored responses expired, so a retry is
+        processed again instead of being told it succeeded.
+        """
+        if error:
+            account_ids = set()
+            for key, response, uid, user, mid, merchant, amount in payments:
+                account_ids.update((uid, mid))
+            
+            with self.account_locks.locked(*account_ids), self.storage.transaction():
+                touched_users = {}
+                touched_merchants = {}
+                for key, response, uid, user, mid, merchant, amount in payments:
+                    user["balance"] += amount
+                    merchant["balance"] -= amount
+                    touched_users[uid] = user
+                    touched_merchants[mid] = merchant
+                    if key is not None:
+                        self.account_store.log_idempotency(key, response, 0)
+                
+                for uid, user in touched_users.items():
+                    self.account_store.log_user(uid, user)
+                for mid, merchant in touched_merchants.items():
+                    self.account_store.log_merchant(mid, merchant)
+        
+        for key, response, uid, user, mid, merchant, amount in payments:
+            if key is None:
+                continue
+            if not error:
+                self.idempotency_cache.set(key, response)
+            self.committing_keys.discard(key)
+    
+    def _replayed_response(self, key):
+        """Get the stored response of an already committed payment, or None"""
+        if key is None:
+            return None
+        response = self.idempotency_cache.get(key)
+        if response is None:
+            return None
+        return dict(response, replayed=True)
+    
+    def process_transactions_batch(self, payments):
+        """
+        Process many payments from UPI machines together
+        
+        Every payment is validated as in process_transaction, then all
+        accounts involved are locked at once and the payments are applied
+        in order. Each bank's chain gets its new transactions in a single
+        append, every touched account is logged once and the batch is made
+        durable with one commit. Returns a result for each payment in the
+        order given; a payment failing doesn't affect the others.
+        """
+        if not isinstance(payments, list):
+            return {"status": "error", "message": "payments must be a list"}
+        
+        results = [None] * len(payments)
+        accepted = []
+        batch_keys = {}  # Idempotency key -> position of its first payment in the batch
+        repeated = []  # (position, position of the earlier payment with the same key)
+        
+        for position, data in enumerate(payments):
+            error, uid, user, merchant, amount = self._validate_payment(data)
+            if error:
+                results[position] = error
+                continue
+            
+            idempotency_key = self._idempotency_key(uid, data)
+            if idempotency_key in batch_keys:
+                repeated.append((position, batch_keys[idempotency_key]))
+                continue
+            replayed = self._replayed_response(idempotency_key)
+            if replayed:
+                results[position] = replayed
+                continue
+            if idempotency_key is not None:
+                batch_keys[idempotency_key] = position
+            
+            accepted.append((position, uid, user, data["mid"], merchant, amount, idempotency_key))
+        
+        account_ids = set()
+        banks = set()
+        for position, uid, user, mid, merchant, amount, idempotency_key in accepted:
+            account_ids.update((uid, mid))
+            banks.update((user["bank"], merchant["bank"]))
+        
+        with self.account_locks.locked(*account_ids), self.storage.transaction(), \
+                self.chains_locked(*banks):
+            bank_transactions = {}  # bank -> [(position, transaction_data)]
+            touched_users = {}
+            touched_merchants = {}
+            applied = []  # (idempotency_key, response, uid, user, mid, merchant, amount)
+            
+            for position, uid, user, mid, merchant, amount, idempotency_key in accepted:
+                # A retry may have overtaken its first attempt before the lock
+                replayed = self._replayed_response(idempotency_key)
+                if replayed:
+                    results[position] = replayed
+                    continue
+                if idempotency_key in self.committing_keys:
+                    results[position] = self._still_committing_error()
+                    continue
+                
+                if user["balance"] < amount:
+                    results[position] = {"status": "error", "message": "Insufficient balance"}
+                    continue
+                
+                user["balance"] -= amount
+                merchant["balance"] += amount
+                touched_users[uid] = user
+                touched_merchants[mid] = merchant
+                
+                # The chains stay locked until the transactions are
+                # appended below, so they go on in timestamp order
+                timestamp = self._next_timestamp(*{user["bank"], merchant["bank"]})
+                transaction_id = f"{uid}_{mid}_{timestamp}"
+                transaction_data = {
+                    "transaction_id": transaction_id,
+                    "from_user": uid,
+                    "to_merchant": mid,
+                    "amount": amount,
+                    "timestamp": timestamp,
+                    "user_bank": user["bank"],
+                    "merchant_bank": merchant["bank"]
+                }
+                
+                bank_transactions.setdefault(user["bank"], []).append((position, transaction_data))
+                if user["bank"] != merchant["bank"]:
+                    bank_transactions.setdefault(merchant["bank"], []).append((position, transaction_data))
+                
+                results[position] = {
+                    "status": "success",
+                    "message": "Transaction processed successfully",
+                    "transaction_id": transaction_id,
+                    "amount": amount,
+                    "timestamp": timestamp,
+                    "user_balance": user["balance"],
+                    "merchant_balance": merchant["balance"],
+                    "receipts": {}
+                }
+                applied.append((idempotency_key, results[position], uid, user, mid, merchant, amount))
+            
+            # One pass over each bank's chain
+            for bank, items in bank_transactions.items():
+                receipts = self.blockchains[bank].add_transactions([transaction_data for _, transaction_data in items])
+                for (position, transaction_data), receipt in zip(items, receipts):
+                    results[position]["receipts"].update(self._receipt_summary({bank: receipt}))
+            
+            for idempotency_key, response, uid, user, mid, merchant, amount in applied:
+                self._log_response(idempotency_key, response)
+            
+            # Log each account's final balance once
+            for uid, user in touched_users.items():
+                self.account_store.log_user(uid, user)
+            for mid, merchant in touched_merchants.items():
+                self.account_store.log_merchant(mid, merchant)
+        
+        # Only report success once the whole batch is durable
+        error = self.commit()
+        self._settle_payments(applied, error)
+        if error:
+            return error
+        
+        for position, first_position in repeated:
+            results[position] = dict(results[first_position], replayed=True)
+        
+        processed = sum(1 for result in results if result["status"] == "success")
+        return {
+            "status": "success",
+            "message": f"Processed {processed} of {len(payments)} payments",
+            "results": results
+        }
+    
+    def list_accounts(self, name, accounts, account_ids, request):
+        """
+        Get one page of accounts, in registration order
+        
+        Optional request fields:
+            cursor: next_cursor of the previous page
+            limit: accounts per page (capped at list_max_page_size)
+            fields: account fields to return, e.g. [] for just the IDs
+            bank / ifsc_code: only return accounts at this bank or branch
+        
+        Returns the page as {name: {account_id: account}} with next_cursor
+        set to None on the last page. At most LIST_SCAN_LIMIT accounts are
+        examined from the cursor, so the work per request is bounded no
+        matter how many accounts exist.
+        """
+        try:
+            start = int(request.get("cursor") or 0)
+            limit = int(request.get("limit") or BANK_SETTINGS.get("list_page_size", 100))
+        except (TypeError, ValueError):
+            return {"status": "error", "message": "Invalid cursor or limit"}
+        if start < 0 or limit < 1:
+            return {"status": "error", "message": "Invalid cursor or limit"}
+        limit = min(limit, BANK_SETTINGS.get("list_max_page_size", 1000))
+        
+        fields = request.get("fields")
+        bank = request.get("bank")
+        ifsc_code = request.get("ifsc_code")
+        
+        page = {}
+        position = start
+        end = min(len(account_ids), start + max(limit, LIST_SCAN_LIMIT))
+        while position < end and len(page) < limit:
+            account_id = account_ids[position]
+            account = accounts[account_id]
+            position += 1
+            
+            if bank is not None and account.get("bank") != bank:
+                continue
+            if ifsc_code is not None and account.get("ifsc_code") != ifsc_code:
+                continue
+            
+            if fields is None:
+                page[account_id] = account
+            else:
+                page[account_id] = {field: account[field] for field in fields if field in account}
+        
+        return {
+            "status": "success",
+            name: page,
+            "next_cursor": str(position) if position < len(account_ids) else None
         }
     
     def validate_merchant(self, mid, password):
@@ -298,9 +741,10 @@ class BankServer:
             return {"status": "error", "message": "Invalid Merchant ID"}
         
         # Use SPECK for lightweight encryption
-        speck = SPECK(mid)  # Use merchant ID as the key
+        speck = self.cipher_cache.get(mid)  # Use merchant ID as the key
         timestamp = str(time.time())
         vmid = speck.encrypt(f"{mid}_{timestamp}")
+        self.vmid_index.set(vmid, mid)
         
         return {
             "status": "success",
@@ -312,7 +756,7 @@ class BankServer:
     def decode_vmid(self, vmid, mid):
         """Decode Virtual Merchant ID using LWC"""
         # Use SPECK for lightweight decryption
-        speck = SPECK(mid)  # Use merchant ID as the key
+        speck = self.cipher_cache.get(mid)  # Use merchant ID as the key
         try:
             decrypted = speck.decrypt(vmid)
             # Verify the decrypted data contains the original MID
@@ -325,6 +769,36 @@ class BankServer:
         except Exception as e:
             return {"status": "error", "message": f"Decryption error: {e}"}
     
+    def resolve_vmid(self, vmid):
+        """
+        Find the merchant a Virtual Merchant ID belongs to
+        
+        VMIDs issued by generate_vmid are looked up in the VMID index. Older
+        or expired VMIDs are decrypted under every merchant's key in one
+        batched pass, and the match is confirmed with decode_vmid.
+        """
+        mid = self.vmid_index.get(vmid)
+        if mid is not None and mid in self.merchants:
+            return {"status": "success", "mid": mid}
+        
+        decryptor = self.merchant_decryptor
+        if decryptor is None or len(decryptor.keys) != len(self.merchants):
+            # Merchants were added since the keys were prepared
+            decryptor = SpeckBatchDecryptor(list(self.merchants))
+            self.merchant_decryptor = decryptor
+        
+        try:
+            candidates = decryptor.find_keys_in_plaintext(vmid)
+        except Exception as e:
+            return {"status": "error", "message": f"Decryption error: {e}"}
+        
+        for mid in candidates:
+            if self.decode_vmid(vmid, mid)["status"] == "success":
+                self.vmid_index.set(vmid, mid)
+                return {"status": "success", "mid": mid}
+        
+        return {"status": "error", "message": "Could not decode VMID"}
+    
     def get_merchant_balance(self, mid):
         """Get merchant balance"""
         merchant = self.merchants.get(mid)
@@ -336,30 +810,69 @@ class BankServer:
             "balance": merchant["balance"]
         }
     
-    def get_user_balance(self, mmid, pin):
-        """Get user balance"""
-        uid = self.mmid_to_uid.get(mmid)
+    def authenticate_user(self, token=None, mmid=None, pin=None):
+        """
+        Find the user a request is made by, returning (error, uid, user)
+        
+        A session token from login() is checked with a single cache lookup.
+        Without a token the MMID and PIN are verified instead.
+        """
+        if token is not None:
+            uid = self.sessions.get(token)
+            user = self.users.get(uid)
+            if not user:
+                return {"status": "error", "message": "Invalid or expired session", "session_expired": True}, None, None
+            return None, uid, user
+        
+        # Get user ID from MMID
+        uid = self.account_store.find_uid(mmid)
         if not uid:
-            return {"status": "error", "message": "Invalid MMID"}
+            return {"status": "error", "message": "Invalid MMID"}, None, None
         
+        # Verify PIN
         user = self.users.get(uid)
         if not user or user["pin"] != pin:
-            return {"status": "error", "message": "Invalid PIN"}
+            return {"status": "error", "message": "Invalid PIN"}, None, None
+        
+        return None, uid, user
+    
+    def login(self, mmid, pin):
+        """Verify a user's MMID and PIN once and issue a session token"""
+        error, uid, user = self.authenticate_user(mmid=mmid, pin=pin)
+        if error:
+            return error
+        
+        token = secrets.token_hex(16)
+        self.sessions.set(token, uid)
         
         return {
             "status": "success",
+            "token": token,
+            "expires_in": self.sessions.ttl,
             "balance": user["balance"]
         }
     
-    def get_user_transactions(self, mmid, pin):
-        """Get user transactions"""
-        uid = self.mmid_to_uid.get(mmid)
-        if not uid:
-            return {"status": "error", "message": "Invalid MMID"}
+    def logout(self, token):
+        """End a session"""
+        self.sessions.pop(token)
+        return {"status": "success", "message": "Logout successful"}
+    
+    def get_user_balance(self, token=None, mmid=None, pin=None):
+        """Get user balance"""
+        error, uid, user = self.authenticate_user(token, mmid, pin)
+        if error:
+            return error
         
-        user = self.users.get(uid)
-        if not user or user["pin"] != pin:
-            return {"status": "error", "message": "Invalid PIN"}
+        return {
+            "status": "success",
+            "balance": user["balance"]
+        }
+    
+    def get_user_transactions(self, token=None, mmid=None, pin=None):
+        """Get user transactions"""
+        error, uid, user = self.authenticate_user(token, mmid, pin)
+        if error:
+            return error
         
         # Get transactions from blockchain
         bank_name = user["bank"]
@@ -385,7 +898,52 @@ class BankServer:
             "transactions": transactions
         }
     
-    def get_transaction_history(self, bank_name=None, uid=None, mid=None):
+    def get_transaction(self, transaction_id):
+        """Look up a transaction by ID across all bank blockchains"""
+        transaction = None
+        blocks = []
+        
+        # A cross-bank payment is recorded on both banks' chains
+        for bank_name, blockchain in self.blockchains.items():
+            location = blockchain.get_transaction_location(transaction_id)
+            if location is not None:
+                block_index, leaf_index = location
+                block = blockchain.chain[block_index]
+                transaction = block.get_transaction_at(leaf_index)
+                blocks.append({
+                    "bank": bank_name,
+                    "block_index": block_index,
+                    "leaf_index": leaf_index,
+                    "block_hash": block.hash
+                })
+        
+        if transaction is None:
+            return {"status": "error", "message": "Transaction not found"}
+        
+        return {
+            "status": "success",
+            "transaction": transaction,
+            "blocks": blocks
+        }
+    
+    def get_transaction_proof(self, transaction_id, bank_name=None):
+        """Get an inclusion proof for a transaction from a bank's blockchain"""
+        if bank_name and bank_name not in self.blockchains:
+            return {"status": "error", "message": "Invalid bank"}
+        
+        banks = [bank_name] if bank_name else list(self.blockchains.keys())
+        for bank in banks:
+            proof = self.blockchains[bank].get_transaction_proof(transaction_id)
+            if proof is not None:
+                return {
+                    "status": "success",
+                    "bank": bank,
+                    "proof": proof
+                }
+        
+        return {"status": "error", "message": "Transaction not found"}
+    
+    def get_transaction_history(self, bank_name=None, uid=None, mid=None, limit=None, offset=0):
         """
         View transaction history with optional filtering by bank, user, or merchant
         
@@ -393,43 +951,47 @@ class BankServer:
             bank_name (str, optional): Filter by bank name (HDFC, ICICI, SBI)
             uid (str, optional): Filter by user ID
             mid (str, optional): Filter by merchant ID
+            limit (int, optional): Return at most this many transactions
+            offset (int, optional): Skip this many of the most recent transactions
             
         Returns:
-            List of transactions matching the filter criteria
+            List of transactions matching the filter criteria, most recent first
+        """
+        stop = None if limit is None else offset + limit
+        return list(islice(self.iter_transaction_history(bank_name, uid, mid), offset, stop))
+    
+    def iter_transaction_history(self, bank_name=None, uid=None, mid=None):
+        """
+        Yield matching transactions from the selected chains, most recent first
+        
+        The chains' own newest-first streams are merged with heapq.merge, so
+        the first N transactions cost O(N log banks) instead of a sort of
+        every transaction. This relies on each chain being in timestamp
+        order, which chains_locked and _next_timestamp guarantee. A
+        cross-bank payment is on both chains and is yielded once, tagged
+        with the first bank it was found in. Yielded transactions are
+        copies with a 'bank' field added.
         """
-        all_transactions = []
-        seen_transaction_ids = set()
-        
         # Determine which blockchains to check
         if bank_name and bank_name in self.blockchains:
             blockchains_to_check = {bank_name: self.blockchains[bank_name]}
         else:
             blockchains_to_check = self.blockchains
         
-        # Get transactions from each blockchain
-        for bank, blockchain in blockchains_to_check.items():
-            if uid:
-                # Get transactions for specific user
-                transactions = blockchain.get_transactions_by_user(uid)
-            elif mid:
-                # Get transactions for specific merchant
-                transactions = blockchain.get_transactions_by_merchant(mid)
-            else:
-                # Get all transactions
-                transactions = blockchain.get_all_transactions()
-            
-            # Add bank name to each transaction for clarity
-            for transaction in transactions:
-                transaction_id = transaction.get('transaction_id', '')
-                if transaction_id not in seen_transaction_ids:
-                    transaction['bank'] = bank
-                    all_transactions.append(transaction)
-                    seen_transaction_ids.add(transaction_id)
-        
-        # Sort transactions by timestamp (most recent first)
-        all_transactions.sort(key=lambda x: x.get('timestamp', 0), reverse=True)
+        streams = [self._tag_transactions(bank, blockchain.iter_transactions(uid, mid))
+                   for bank, blockchain in blockchains_to_check.items()]
         
-        return all_transactions
+        seen_transaction_ids = set()
+        for transaction in heapq.merge(*streams, key=lambda x: x.get('timestamp', 0), reverse=True):
+            transaction_id = transaction.get('transaction_id', '')
+            if transaction_id not in seen_transaction_ids:
+                seen_transaction_ids.add(transaction_id)
+                yield transaction
+    
+    def _tag_transactions(self, bank, transactions):
+        """Yield copies of transactions with the bank they were found in"""
+        for transaction in transactions:
+            yield dict(transaction, bank=bank)
     
     def view_transaction_history_ui(self):
         """UI for viewing transaction history with improved display and export options"""
@@ -477,8 +1039,14 @@ class BankServer:
             print("Invalid choice.")
             return
         
+        # Only the most recent transactions are read when a limit is given
+        limit = input("Show the most recent N transactions (leave blank for all): ").strip()
+        if limit and (not limit.isdigit() or int(limit) == 0):
+            print("Invalid number.")
+            return
+        
         # Get transaction history
-        transactions = self.get_transaction_history(bank_name, uid, mid)
+        transactions = self.get_transaction_history(bank_name, uid, mid, int(limit) if limit else None)
         
         if not transactions:
             print("\nNo transactions found matching the criteria.")
@@ -557,61 +1125,62 @@ class BankServer:
         except Exception as e:
             print(f"\nError saving transaction history: {e}")
     
+    def dispatch_request(self, request):
+        """Process a decoded request and return the response"""
+        response = {"status": "error", "message": "Unknown request type"}
+        
+        if "type" in request:
+            if request["type"] == "register_merchant":
+                response = self.register_merchant(request["data"])
+            elif request["type"] == "register_user":
+                response = self.register_user(request["data"])
+            elif request["type"] == "process_transaction":
+                response = self.process_transaction(request["data"])
+            elif request["type"] == "process_transactions_batch":
+                response = self.process_transactions_batch(request["payments"])
+            elif request["type"] == "validate_merchant":
+                valid = self.validate_merchant(request["mid"], request["password"])
+                response = {"status": "success" if valid else "error", 
+                           "message": "Valid credentials" if valid else "Invalid credentials"}
+            elif request["type"] == "generate_vmid":
+                response = self.generate_vmid(request["mid"])
+            elif request["type"] == "decode_vmid":
+                response = self.decode_vmid(request["vmid"], request["mid"])
+            elif request["type"] == "resolve_vmid":
+                response = self.resolve_vmid(request["vmid"])
+            elif request["type"] == "get_merchant_balance":
+                response = self.get_merchant_balance(request["mid"])
+            elif request["type"] == "login":
+                response = self.login(request["mmid"], request["pin"])
+            elif request["type"] == "logout":
+                response = self.logout(request["token"])
+            elif request["type"] == "get_user_balance":
+                response = self.get_user_balance(request.get("token"), request.get("mmid"), request.get("pin"))
+            elif request["type"] == "get_user_transactions":
+                response = self.get_user_transactions(request.get("token"), request.get("mmid"), request.get("pin"))
+            elif request["type"] == "get_merchant_transactions":
+                response = self.get_merchant_transactions(request["mid"], request["password"])
+            elif request["type"] == "get_transaction":
+                response = self.get_transaction(request["transaction_id"])
+            elif request["type"] == "get_transaction_proof":
+                response = self.get_transaction_proof(request["transaction_id"], request.get("bank"))
+            elif request["type"] == "list_merchants":
+                response = self.list_accounts("merchants", self.merchants, self.merchant_ids, request)
+            elif request["type"] == "list_users":
+                response = self.list_accounts("users", self.users, self.user_ids, request)
+        
+        return response
+    
     def handle_client(self, client_socket):
-        """Handle client connection"""
-        try:
-            # Receive data from client
-            data = client_socket.recv(4096).decode()
-            request = json.loads(data)
-            
-            # Process request
-            response = {"status": "error", "message": "Unknown request type"}
-            
-            if "type" in request:
-                if request["type"] == "register_merchant":
-                    response = self.register_merchant(request["data"])
-                elif request["type"] == "register_user":
-                    response = self.register_user(request["data"])
-                elif request["type"] == "process_transaction":
-                    response = self.process_transaction(request["data"])
-                elif request["type"] == "validate_merchant":
-                    valid = self.validate_merchant(request["mid"], request["password"])
-                    response = {"status": "success" if valid else "error", 
-                               "message": "Valid credentials" if valid else "Invalid credentials"}
-                elif request["type"] == "generate_vmid":
-                    response = self.generate_vmid(request["mid"])
-                elif request["type"] == "decode_vmid":
-                    response = self.decode_vmid(request["vmid"], request["mid"])
-                elif request["type"] == "get_merchant_balance":
-                    response = self.get_merchant_balance(request["mid"])
-                elif request["type"] == "get_user_balance":
-                    response = self.get_user_balance(request["mmid"], request["pin"])
-                elif request["type"] == "get_user_transactions":
-                    response = self.get_user_transactions(request["mmid"], request["pin"])
-                elif request["type"] == "get_merchant_transactions":
-                    response = self.get_merchant_transactions(request["mid"], request["password"])
-                elif request["type"] == "list_merchants":
-                    # Just for testing
-                    response = {"status": "success", "merchants": self.merchants}
-                elif request["type"] == "list_users":
-                    # Just for testing
-                    response = {"status": "success", "users": self.users}
-                
-            # Send response
-            client_socket.sendall(json.dumps(response).encode())
-            
-        except Exception as e:
-            print(f"Error handling client: {e}")
-            try:
-                error_response = {"status": "error", "message": f"Server error: {str(e)}"}
-                client_socket.sendall(json.dumps(error_response).encode())
-            except:
-                pass
-        finally:
-            client_socket.close()
+        """Handle client connection, answering requests until the client disconnects"""
+        serve_connection(client_socket, self.dispatch_request)
     
     def start_server(self):
         """Start the bank server"""
+        if BANK_SETTINGS.get("server_mode", "threads") == "asyncio":
+            self.start_async_server()
+            return
+        
         print("Bank Server is running. Waiting for connections...")
         
         try:
@@ -635,7 +1204,7 @@ class BankServer:
                         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
                         self.server_socket.bind(('0.0.0.0', PORT_BANK))
-                        self.server_socket.listen(5)
+                        self.server_socket.listen(BANK_SETTINGS.get("listen_backlog", 5))
                         continue
                     else:
                         raise
@@ -649,6 +1218,87 @@ class BankServer:
                     pass
             self.save_data()
     
+    def start_async_server(self):
+        """Start the bank server on an asyncio event loop"""
+        print("Bank Server is running (asyncio). Waiting for connections...")
+        
+        try:
+            asyncio.run(self.serve_async())
+        except KeyboardInterrupt:
+            print("Bank Server shutting down...")
+        finally:
+            try:
+                self.server_socket.close()
+            except:
+                pass
+            self.save_data()
+    
+    async def serve_async(self):
+        """
+        Accept connections on the event loop
+        
+        Connections are multiplexed on one thread; request handlers (which
+        hash, validate chains and wait for durable commits) run in a bounded
+        thread pool so the loop never blocks. Connections beyond
+        max_connections are turned away instead of queuing without limit.
+        """
+        self.handler_pool = ThreadPoolExecutor(max_workers=BANK_SETTINGS.get("handler_workers", 32))
+        self.max_connections = BANK_SETTINGS.get("max_connections", 10000)
+        self.active_connections = 0
+        
+        self.server_socket.setblocking(False)
+        server = await asyncio.start_server(
+            self.handle_client_async,
+            sock=self.server_socket,
+            backlog=BANK_SETTINGS.get("listen_backlog", 5)
+        )
+        
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.handler_pool.shutdown(wait=False)
+    
+    async def handle_client_async(self, reader, writer):
+        """Handle a client connection on the event loop, answering requests until it disconnects"""
+        if self.active_connections >= self.max_connections:
+            response = {"status": "error", "message": "Server busy, try again later"}
+            writer.write(encode_frame(response))
+            writer.close()
+            return
+        
+        self.active_connections += 1
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(read_frame(reader), CONNECTION_IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break  # Idle keep-alive connection
+                if request is None:
+                    break
+                
+                # Process request in the handler pool
+                try:
+                    response = await loop.run_in_executor(self.handler_pool, self.dispatch_request, request)
+                except Exception as e:
+                    print(f"Error handling client: {e}")
+                    response = {"status": "error", "message": f"Server error: {str(e)}"}
+                
+                writer.write(encode_frame(response))
+                await writer.drain()
+        except Exception as e:
+            print(f"Error handling client: {e}")
+            try:
+                error_response = {"status": "error", "message": f"Server error: {str(e)}"}
+                writer.write(encode_frame(error_response))
+                await writer.drain()
+            except:
+                pass
+        finally:
+            self.active_connections -= 1
+            writer.close()
+    
     def start(self):
         """Start the bank terminal UI"""
         while True:
@@ -758,9 +1408,34 @@ class BankServer:
     def validate_blockchain(self):
         """Validate the integrity of blockchains"""
         print("\n----- Blockchain Validation -----")
+        print("1. Quick check (blocks added since the last verified checkpoint)")
+        print("2. Full audit (every block)")
+        
+        choice = input("Enter your choice (1-2): ")
+        if choice not in ["1", "2"]:
+            print("Invalid choice.")
+            return
+        
+        if choice == "2":
+            # Audit all bank chains concurrently across CPU cores
+            start_time = time.time()
+            results = verify_chains_parallel(self.blockchains, workers=BANK_SETTINGS.get("verify_workers"))
+            elapsed_ms = (time.time() - start_time) * 1000
+            
+            for bank_name, first_bad in results.items():
+                if first_bad is None:
+                    print(f"{bank_name} Bank Blockchain: Valid")
+                else:
+                    print(f"{bank_name} Bank Blockchain: INVALID - TAMPERING DETECTED at block #{first_bad}!")
+            print(f"Full audit completed in {elapsed_ms:.1f} ms")
+            return
+        
         for bank_name, blockchain in self.blockchains.items():
+            start_time = time.time()
             is_valid = blockchain.is_chain_valid()
-            print(f"{bank_name} Bank Blockchain: {'Valid' if is_valid else 'INVALID - TAMPERING DETECTED!'}")
+            elapsed_ms = (time.time() - start_time) * 1000
+            print(f"{bank_name} Bank Blockchain: {'Valid' if is_valid else 'INVALID - TAMPERING DETECTED!'} "
+                  f"({elapsed_ms:.1f} ms, verified up to block #{blockchain.verified_height})")
     
     def register_merchant_ui(self):
         """UI for registering a new merchant"""
@@ -850,7 +1525,7 @@ class BankServer:
         
         mmid = input("Enter user MMID to target: ")
         
-        uid = self.mmid_to_uid.get(mmid)
+        uid = self.account_store.find_uid(mmid)
         if not uid:
             print("Invalid MMID.")
             return
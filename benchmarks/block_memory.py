@@ -0,0 +1,87 @@
+"""
+Memory-per-block benchmark for the blockchain Block layout
+
+Compares the original Block (regular object with a __dict__ and a nested
+transaction_data dict) with the current __slots__ Block that keeps the
+transaction data only in its cached canonical encoding.
+
+Usage: python benchmarks/block_memory.py [number_of_blocks]
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blockchain import Block # type: ignore
+
+class LegacyBlock:
+    """Block layout used before __slots__ and cached encodings"""
+    def __init__(self, index, timestamp, transaction_data, previous_hash):
+        self.index = index
+        self.timestamp = timestamp
+        self.transaction_data = transaction_data
+        self.previous_hash = previous_hash
+        self.hash = self.calculate_hash()
+
+    def calculate_hash(self):
+        """Calculate hash of the block"""
+        block_string = json.dumps({
+            "index": self.index,
+            "timestamp": self.timestamp,
+            "transaction_data": self.transaction_data,
+            "previous_hash": self.previous_hash
+        }, sort_keys=True).encode()
+
+        return hashlib.sha256(block_string).hexdigest()
+
+def make_transaction(i):
+    """Build a transaction shaped like the ones BankServer records"""
+    uid = hashlib.sha256(f"user_{i % 1000}".encode()).hexdigest()[:16]
+    mid = hashlib.sha256(f"merchant_{i % 100}".encode()).hexdigest()[:16]
+    timestamp = 1743840744.448654 + i
+    return {
+        "transaction_id": f"{uid}_{mid}_{timestamp}",
+        "from_user": uid,
+        "to_merchant": mid,
+        "amount": float(i % 5000),
+        "timestamp": timestamp,
+        "user_bank": "ICICI",
+        "merchant_bank": "HDFC"
+    }
+
+def build_chain(block_class, count):
+    """Build a chain of count blocks and return (bytes per block, seconds)"""
+    tracemalloc.start()
+    start_time = time.time()
+
+    chain = [block_class(0, 0.0, {"transaction_id": "genesis"}, "0")]
+    for i in range(1, count):
+        chain.append(block_class(i, 1743840744.0 + i, make_transaction(i), chain[-1].hash))
+
+    elapsed = time.time() - start_time
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return current / count, elapsed
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    print(f"Building {count} blocks per layout...")
+    legacy_bytes, legacy_time = build_chain(LegacyBlock, count)
+    slots_bytes, slots_time = build_chain(Block, count)
+
+    print(f"{'Layout':<28} {'Bytes/block':>12} {'Build time':>12}")
+    print("-" * 54)
+    print(f"{'__dict__ + nested dict':<28} {legacy_bytes:>12.0f} {legacy_time:>11.2f}s")
+    print(f"{'__slots__ + cached encoding':<28} {slots_bytes:>12.0f} {slots_time:>11.2f}s")
+    print(f"\nMemory saved: {100 * (1 - slots_bytes / legacy_bytes):.1f}%")
+
+if __name__ == "__main__":
+    main()
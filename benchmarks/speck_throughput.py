@@ -0,0 +1,80 @@
+"""
+Throughput benchmark for the SPECK cipher
+
+Compares the original per-block SPECK loop with the current SPECK class
+(key schedule computed once, blocks processed as NumPy arrays when NumPy
+is installed) on a batch of VMID-sized messages and on one large message.
+Also checks that both produce the same ciphertext.
+
+Usage: python benchmarks/speck_throughput.py [number_of_messages]
+"""
+
+import base64
+import os
+import sys
+import time
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common_utils import SPECK, np # type: ignore
+
+class LegacySPECK:
+    """SPECK implementation used before the vectorized version"""
+    def __init__(self, key):
+        self.key = key.ljust(16, '0')[:16].encode()
+
+    def _rotate_right(self, val, r):
+        return ((val >> r) | (val << (32 - r))) & 0xFFFFFFFF
+
+    def _rotate_left(self, val, r):
+        return ((val << r) | (val >> (32 - r))) & 0xFFFFFFFF
+
+    def encrypt(self, text):
+        text_bytes = text.encode()
+        padded_text = text_bytes + b'\0' * (8 - len(text_bytes) % 8 if len(text_bytes) % 8 else 0)
+        k = [int.from_bytes(self.key[i:i+4], 'little') for i in range(0, 16, 4)]
+
+        result = bytearray()
+        for i in range(0, len(padded_text), 8):
+            block = padded_text[i:i+8]
+            x = int.from_bytes(block[0:4], 'little')
+            y = int.from_bytes(block[4:8], 'little')
+            for _ in range(20):
+                x = (self._rotate_right(x, 8) + y) & 0xFFFFFFFF
+                x ^= k[0]
+                y = self._rotate_left(y, 3) ^ x
+            result.extend(x.to_bytes(4, 'little'))
+            result.extend(y.to_bytes(4, 'little'))
+
+        return base64.b64encode(result).decode()
+
+def timed(function, *args):
+    """Run function once and return (result, seconds)"""
+    start_time = time.time()
+    result = function(*args)
+    return result, time.time() - start_time
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    mid = "6c1a0844a8b6e36d"
+    messages = [f"{mid}_{1743840744.448654 + i}" for i in range(count)]
+    large_message = "x" * 1000000
+
+    legacy = LegacySPECK(mid)
+    speck = SPECK(mid)
+
+    legacy_batch, legacy_batch_time = timed(lambda: [legacy.encrypt(m) for m in messages])
+    batch, batch_time = timed(speck.encrypt_many, messages)
+    legacy_large, legacy_large_time = timed(legacy.encrypt, large_message)
+    large, large_time = timed(speck.encrypt, large_message)
+
+    print(f"NumPy: {'yes' if np is not None else 'no (pure Python fallback)'}")
+    print(f"{'Workload':<28} {'Legacy':>10} {'Current':>10} {'Speedup':>9}")
+    print("-" * 60)
+    print(f"{f'{count} VMIDs':<28} {legacy_batch_time:>9.3f}s {batch_time:>9.3f}s {legacy_batch_time / batch_time:>8.0f}x")
+    print(f"{'1 MB message':<28} {legacy_large_time:>9.3f}s {large_time:>9.3f}s {legacy_large_time / large_time:>8.0f}x")
+    print(f"\nIdentical output: {legacy_batch == batch and legacy_large == large}")
+
+if __name__ == "__main__":
+    main()
@@ -4,29 +4,161 @@ Blockchain implementation for UPI Payment Gateway System
 
 import hashlib
 import json
+import os
+import threading
 import time
+from array import array
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
+# Seconds a partially filled batch block may wait before it is sealed
+DEFAULT_SEAL_INTERVAL = 0.5
+
+# Ledger record holding one journaled transaction of a batch block
+TRANSACTION_RECORD_PREFIX = b'{"tx": '
+
+# Blocks per range handed to a worker by verify_chains_parallel()
+DEFAULT_VERIFY_RANGE_SIZE = 20000
+# Ranges submitted but not yet collected, per worker
+VERIFY_RANGES_IN_FLIGHT = 2
+
+def encode_transaction(transaction_data):
+    """Canonical byte encoding of a transaction (a Merkle leaf)"""
+    return json.dumps(transaction_data, sort_keys=True).encode()
+
+def merkle_root(leaf_hashes):
+    """Compute the Merkle root of a list of hex leaf hashes"""
+    if not leaf_hashes:
+        return hashlib.sha256(b"").hexdigest()
+    
+    level = list(leaf_hashes)
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])  # Odd levels pair their last hash with itself
+        level = [hashlib.sha256((level[i] + level[i + 1]).encode()).hexdigest()
+                 for i in range(0, len(level), 2)]
+    
+    return level[0]
+
+def merkle_path(leaf_hashes, leaf_index):
+    """Get the sibling hashes from a leaf up to the Merkle root as [side, hash] pairs"""
+    path = []
+    level = list(leaf_hashes)
+    index = leaf_index
+    
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        sibling = index ^ 1
+        path.append(["left" if sibling < index else "right", level[sibling]])
+        level = [hashlib.sha256((level[i] + level[i + 1]).encode()).hexdigest()
+                 for i in range(0, len(level), 2)]
+        index //= 2
+    
+    return path
+
+def verify_merkle_path(leaf_hash, path, root):
+    """Check that a Merkle path leads from a leaf hash to the root"""
+    current = leaf_hash
+    for side, sibling in path:
+        pair = sibling + current if side == "left" else current + sibling
+        current = hashlib.sha256(pair.encode()).hexdigest()
+    return current == root
+
+def verify_transaction_proof(proof):
+    """
+    Verify a transaction inclusion proof from Blockchain.get_transaction_proof
+    
+    Checks that the transaction hashes up the Merkle path to the root in the
+    block header and that the header hashes to the block hash. For blocks
+    holding a single transaction the block hash covers the transaction
+    directly and the path is empty.
+    """
+    header = proof["header"]
+    transaction = proof["transaction"]
+    
+    if "merkle_root" in header:
+        leaf_hash = hashlib.sha256(encode_transaction(transaction)).hexdigest()
+        if not verify_merkle_path(leaf_hash, proof["path"], header["merkle_root"]):
+            return False
+        header_string = json.dumps(header, sort_keys=True).encode()
+    else:
+        header_string = json.dumps(dict(header, transaction_data=transaction), sort_keys=True).encode()
+    
+    return hashlib.sha256(header_string).hexdigest() == proof["block_hash"]
+
 class Block:
-    """Block in the blockchain"""
+    """
+    Block in the blockchain
+    
+    Blocks use __slots__ and keep the transaction data only inside the
+    canonical byte encoding that is hashed. The encoding is reused for
+    re-verification and serialization, and transaction_data is decoded from
+    it on access, so changing a returned dict does not change the block.
+    """
+    __slots__ = ("index", "timestamp", "previous_hash", "hash", "_encoded")
+    
+    # Tail of a ledger record: ', "hash": "<64 hex digits>"}'
+    _RECORD_HASH_PREFIX = b', "hash": "'
+    _RECORD_TAIL_LENGTH = len(_RECORD_HASH_PREFIX) + 64 + 2
+    _RECORD_KEYS = ["index", "previous_hash", "timestamp", "transaction_data", "hash"]
+    
     def __init__(self, index, timestamp, transaction_data, previous_hash):
         self.index = index
         self.timestamp = timestamp
-        self.transaction_data = transaction_data
         self.previous_hash = previous_hash
+        self._encoded = self._encode(transaction_data)
         self.hash = self.calculate_hash()
-        
-    def calculate_hash(self):
-        """Calculate hash of the block"""
-        block_string = json.dumps({
+    
+    def _encode(self, transaction_data):
+        """Build the canonical byte encoding of the block contents"""
+        return json.dumps({
             "index": self.index,
             "timestamp": self.timestamp,
-            "transaction_data": self.transaction_data,
+            "transaction_data": transaction_data,
             "previous_hash": self.previous_hash
         }, sort_keys=True).encode()
+    
+    @property
+    def transaction_data(self):
+        """Transaction data decoded from the canonical encoding"""
+        return json.loads(self._encoded)["transaction_data"]
+    
+    @transaction_data.setter
+    def transaction_data(self, transaction_data):
+        self._encoded = self._encode(transaction_data)
+    
+    @property
+    def transactions(self):
+        """All transactions in the block"""
+        return [self.transaction_data]
+    
+    def get_transaction_at(self, leaf_index):
+        """Get the transaction at a position in the block"""
+        return self.transaction_data
+    
+    def encode(self):
+        """Get the canonical byte encoding that the block hash covers"""
+        return self._encoded
+        
+    def calculate_hash(self, refresh=False):
+        """
+        Calculate hash of the block
+        
+        The cached encoding is hashed by default. With refresh=True the
+        encoding is rebuilt from the block fields first, which also catches
+        fields that no longer match the encoding.
+        """
+        block_string = self._encode(self.transaction_data) if refresh else self._encoded
         
         return hashlib.sha256(block_string).hexdigest()
     
+    def verify(self, refresh=False):
+        """Check that the block contents match its hash"""
+        return self.hash == self.calculate_hash(refresh)
+    
     def __str__(self):
         """String representation of the block"""
         return f"Block #{self.index}\n" \
@@ -45,19 +177,288 @@ class Block:
             'hash': self.hash
         }
     
+    def to_record(self):
+        """Encode the block as a ledger record by appending the hash to the cached encoding"""
+        return self._encoded[:-1] + self._RECORD_HASH_PREFIX + self.hash.encode() + b'"}'
+    
+    def to_records(self):
+        """Get every ledger record needed to store the block"""
+        return [self.to_record()]
+    
+    @staticmethod
+    def from_record(record):
+        """Rebuild a block, or the header of a batch block, from a ledger record"""
+        fields = json.loads(record)
+        block_class = BatchBlock if "merkle_root" in fields else Block
+        
+        block = block_class.__new__(block_class)
+        block._set_fields(fields)
+        
+        tail = record[-Block._RECORD_TAIL_LENGTH:]
+        if tail.startswith(Block._RECORD_HASH_PREFIX) and list(fields) == block_class._RECORD_KEYS:
+            # Written by to_record(): the canonical encoding with the hash appended
+            block._encoded = record[:-Block._RECORD_TAIL_LENGTH] + b"}"
+        else:
+            block._encoded = block._encode_fields(fields)
+        
+        return block
+    
+    def _set_fields(self, fields):
+        """Set the block fields (except the encoding) from a parsed record"""
+        self.index = fields['index']
+        self.timestamp = fields['timestamp']
+        self.previous_hash = fields['previous_hash']
+        self.hash = fields['hash']
+    
+    def _encode_fields(self, fields):
+        """Build the canonical encoding from a parsed record"""
+        return self._encode(fields['transaction_data'])
+    
+    @classmethod
+    def from_dict(cls, block_dict):
+        """Rebuild a block from a dictionary without re-hashing it"""
+        block = cls.__new__(cls)
+        block.rebuild_from_dict(block_dict)
+        return block
+    
     def rebuild_from_dict(self, block_dict):
         """Rebuild block properties from dictionary"""
         self.index = block_dict['index']
         self.timestamp = block_dict['timestamp']
+        self.previous_hash = block_dict['previous_hash']
         self.transaction_data = block_dict['transaction_data']
+        self.hash = block_dict['hash']
+
+class BatchBlock(Block):
+    """
+    Block sealing a batch of transactions under a Merkle root
+    
+    The block hash covers a small header (index, timestamp, previous hash,
+    Merkle root and transaction count). Transactions are bound to the header
+    through the Merkle root over their hashes and are kept as canonical
+    encodings, in the order they were added.
+    """
+    __slots__ = ("merkle_root", "tx_count", "transaction_records")
+    
+    _RECORD_KEYS = ["index", "merkle_root", "previous_hash", "timestamp", "tx_count", "hash"]
+    
+    def __init__(self, index, timestamp, transaction_records, previous_hash):
+        self.index = index
+        self.timestamp = timestamp
+        self.previous_hash = previous_hash
+        self.transaction_records = list(transaction_records)
+        self.tx_count = len(self.transaction_records)
+        self.merkle_root = self.compute_merkle_root()
+        self._encoded = self._encode_header()
+        self.hash = self.calculate_hash()
+    
+    def _encode_header(self):
+        """Build the canonical byte encoding of the block header"""
+        return json.dumps({
+            "index": self.index,
+            "timestamp": self.timestamp,
+            "previous_hash": self.previous_hash,
+            "merkle_root": self.merkle_root,
+            "tx_count": self.tx_count
+        }, sort_keys=True).encode()
+    
+    def header(self):
+        """Get the block header as a dictionary"""
+        return json.loads(self._encoded)
+    
+    def leaf_hashes(self, refresh=False):
+        """Hash each transaction; refresh re-encodes the transactions first"""
+        records = self.transaction_records
+        if refresh:
+            records = [encode_transaction(json.loads(record)) for record in records]
+        return [hashlib.sha256(record).hexdigest() for record in records]
+    
+    def compute_merkle_root(self, refresh=False):
+        """Compute the Merkle root over the block's transactions"""
+        return merkle_root(self.leaf_hashes(refresh))
+    
+    @property
+    def transaction_data(self):
+        """Merkle root and transactions of the block"""
+        return {"merkle_root": self.merkle_root, "transactions": self.transactions}
+    
+    @property
+    def transactions(self):
+        """All transactions in the block"""
+        return [json.loads(record) for record in self.transaction_records]
+    
+    def get_transaction_at(self, leaf_index):
+        """Get the transaction at a position in the block"""
+        return json.loads(self.transaction_records[leaf_index])
+    
+    def calculate_hash(self, refresh=False):
+        """Calculate hash of the block header"""
+        header_string = self._encode_header() if refresh else self._encoded
+        
+        return hashlib.sha256(header_string).hexdigest()
+    
+    def verify(self, refresh=False):
+        """Check the header hash and that the transactions match the Merkle root"""
+        return (self.hash == self.calculate_hash(refresh) and
+                len(self.transaction_records) == self.tx_count and
+                self.merkle_root == self.compute_merkle_root(refresh))
+    
+    def __str__(self):
+        """String representation of the block"""
+        return f"Block #{self.index} ({self.tx_count} transactions)\n" \
+               f"Timestamp: {datetime.fromtimestamp(self.timestamp).strftime('%Y-%m-%d %H:%M:%S')}\n" \
+               f"Transactions: {json.dumps(self.transactions, indent=2)}\n" \
+               f"Merkle Root: {self.merkle_root}\n" \
+               f"Previous Hash: {self.previous_hash}\n" \
+               f"Hash: {self.hash}\n"
+    
+    def serialize(self):
+        """Make the block JSON serializable"""
+        return {
+            'index': self.index,
+            'timestamp': self.timestamp,
+            'previous_hash': self.previous_hash,
+            'merkle_root': self.merkle_root,
+            'transactions': self.transactions,
+            'hash': self.hash
+        }
+    
+    def to_records(self):
+        """Get the journaled transaction records followed by the header record"""
+        records = [TRANSACTION_RECORD_PREFIX + record + b"}" for record in self.transaction_records]
+        records.append(self.to_record())
+        return records
+    
+    def _set_fields(self, fields):
+        """Set the header fields from a parsed record (transactions are attached separately)"""
+        super()._set_fields(fields)
+        self.merkle_root = fields['merkle_root']
+        self.tx_count = fields['tx_count']
+        self.transaction_records = []
+    
+    def _encode_fields(self, fields):
+        """Build the canonical header encoding from a parsed record"""
+        return self._encode_header()
+    
+    def rebuild_from_dict(self, block_dict):
+        """Rebuild block properties from dictionary"""
+        self.index = block_dict['index']
+        self.timestamp = block_dict['timestamp']
         self.previous_hash = block_dict['previous_hash']
+        self.merkle_root = block_dict['merkle_root']
+        self.transaction_records = [encode_transaction(tx) for tx in block_dict['transactions']]
+        self.tx_count = len(self.transaction_records)
+        self._encoded = self._encode_header()
         self.hash = block_dict['hash']
 
+def _block_from_records(records):
+    """Rebuild a block from its ledger records (journaled transactions, then the block record)"""
+    block = Block.from_record(records[-1])
+    if isinstance(block, BatchBlock):
+        block.transaction_records = [record[len(TRANSACTION_RECORD_PREFIX):-1] for record in records[:-1]]
+    return block
+
+def _new_segment_index(first_block):
+    """Create an empty sidecar index for a ledger segment"""
+    return {"first_block": first_block, "blocks": [], "users": {}, "merchants": {}, "transactions": {}}
+
+class LazyChain:
+    """
+    Sequence of blocks that decodes historical blocks on demand
+    
+    The chain is made of parts: sealed ledger segments that are only known
+    by the byte offsets of their blocks and are read from a memory map when
+    a block is accessed, and lists of decoded blocks (the chain tip, plus
+    any segment that could not be mapped). New blocks are appended to the
+    last list.
+    """
+    def __init__(self, store):
+        self.store = store
+        self._starts = []  # Index of the first block of each part
+        self._parts = []  # (segment position, offsets, lengths) or a list of blocks
+        self._length = 0
+    
+    def map_segment(self, position, segment_index):
+        """Add the blocks of a sealed segment, to be decoded when accessed"""
+        offsets = array("Q", (offset for offset, length in segment_index["blocks"]))
+        lengths = array("Q", (length for offset, length in segment_index["blocks"]))
+        self._starts.append(self._length)
+        self._parts.append((position, offsets, lengths))
+        self._length += len(offsets)
+    
+    def extend(self, blocks):
+        """Add decoded blocks to the end of the chain"""
+        if not self._parts or not isinstance(self._parts[-1], list):
+            self._starts.append(self._length)
+            self._parts.append([])
+        self._parts[-1].extend(blocks)
+        self._length += len(blocks)
+    
+    def append(self, block):
+        """Add a decoded block to the end of the chain"""
+        self.extend([block])
+    
+    def __len__(self):
+        return self._length
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("block index out of range")
+        
+        part_number = bisect_right(self._starts, index) - 1
+        part = self._parts[part_number]
+        position = index - self._starts[part_number]
+        if isinstance(part, list):
+            return part[position]
+        
+        segment, offsets, lengths = part
+        data = self.store.read_range(segment, offsets[position], lengths[position])
+        return _block_from_records(data.split(b"\n")[:-1])
+    
+    def __iter__(self):
+        for index in range(self._length):
+            yield self[index]
+
 class Blockchain:
-    """Centralized blockchain ledger for the bank"""
-    def __init__(self, bank_name):
+    """
+    Centralized blockchain ledger for the bank
+    
+    With block_size=1 every transaction gets its own block. With a larger
+    block_size transactions are queued and sealed into one BatchBlock once
+    block_size are waiting or the oldest has waited seal_interval seconds.
+    """
+    def __init__(self, bank_name, block_size=1, seal_interval=DEFAULT_SEAL_INTERVAL):
         self.chain = []
         self.bank_name = bank_name
+        self.store = None  # Append-only ledger storage, see attach_store()
+        
+        # Batch block mode
+        self.block_size = block_size
+        self.seal_interval = seal_interval
+        self.pending = []  # Encoded transactions waiting for the next block
+        self.pending_since = None
+        self.lock = threading.RLock()  # Serializes appends to this chain
+        
+        # Verification checkpoint: blocks up to this height are known good
+        self.verified_height = 0
+        self.verified_hash = None
+        
+        # Secondary indexes over (block position, leaf position) in self.chain,
+        # unused when the store indexes transactions itself (store_indexed)
+        self.store_indexed = False
+        self.user_index = {}  # user_id -> [(block position, leaf position)]
+        self.merchant_index = {}  # merchant_id -> [(block position, leaf position)]
+        self.transaction_index = {}  # transaction_id -> (block position, leaf position)
+        
+        # Sidecar index of the ledger segment receiving new blocks
+        self._segment_position = None
+        self._segment_index = None
+        self._pending_location = None  # Ledger location of the first pending transaction
         
         # Create genesis block
         self.create_genesis_block()
@@ -76,71 +477,377 @@ class Blockchain:
         """Get the latest block in the chain"""
         return self.chain[-1]
     
-    def add_transaction(self, transaction_data):
-        """Add a new transaction to the blockchain"""
-        # Validate transaction data
+    def _validate_transaction(self, transaction_data):
+        """Check a transaction for required fields, returning an error response or None"""
         required_fields = ["transaction_id", "from_user", "to_merchant", "amount", "timestamp"]
         for field in required_fields:
             if field not in transaction_data:
                 return {"status": "error", "message": f"Missing required field: {field}"}
-        
-        # Create a new block for the transaction
-        index = len(self.chain)
-        timestamp = time.time()
-        previous_hash = self.get_latest_block().hash
-        
-        new_block = Block(index, timestamp, transaction_data, previous_hash)
-        self.chain.append(new_block)
-        
+        return None
+    
+    def _block_receipt(self, block):
+        """Receipt for a transaction that got its own block"""
         return {
             "status": "success", 
             "message": f"Transaction added to blockchain", 
-            "block_hash": new_block.hash,
-            "block_index": new_block.index
+            "block_hash": block.hash,
+            "block_index": block.index,
+            "leaf_index": 0,
+            "sealed": True
         }
     
-    def is_chain_valid(self):
-        """Validate the integrity of the blockchain"""
-        for i in range(1, len(self.chain)):
+    def add_transaction(self, transaction_data):
+        """Add a new transaction to the blockchain"""
+        # Validate transaction data
+        error = self._validate_transaction(transaction_data)
+        if error:
+            return error
+        
+        if self.block_size > 1:
+            return self._queue_transaction(transaction_data)
+        
+        with self.lock:
+            # Transactions queued before switching to one block per transaction go first
+            if self.pending:
+                self.seal_pending()
+            
+            # Create a new block for the transaction
+            index = len(self.chain)
+            timestamp = time.time()
+            previous_hash = self.get_latest_block().hash
+            
+            new_block = Block(index, timestamp, transaction_data, previous_hash)
+            self._append_block(new_block, [new_block.to_record()])
+        
+        return self._block_receipt(new_block)
+    
+    def add_transactions(self, transactions):
+        """
+        Add several transactions in one pass, returning a receipt for each
+        
+        With one block per transaction all new blocks are written to the
+        store with a single append. Batch blocks queue the transactions.
+        """
+        if self.block_size > 1:
+            return [self.add_transaction(transaction_data) for transaction_data in transactions]
+        
+        receipts = []
+        new_blocks = []
+        
+        with self.lock:
+            if self.pending:
+                self.seal_pending()
+            
+            previous_hash = self.get_latest_block().hash
+            for transaction_data in transactions:
+                error = self._validate_transaction(transaction_data)
+                if error:
+                    receipts.append(error)
+                    continue
+                
+                new_block = Block(len(self.chain) + len(new_blocks), time.time(), transaction_data, previous_hash)
+                previous_hash = new_block.hash
+                new_blocks.append(new_block)
+                receipts.append(self._block_receipt(new_block))
+            
+            self._append_blocks(new_blocks)
+        
+        return receipts
+    
+    def _queue_transaction(self, transaction_data):
+        """Queue a transaction for the next batch block and return its receipt"""
+        encoded = encode_transaction(transaction_data)
+        
+        with self.lock:
+            # Blocks are sealed in order, so the position is already known
+            block_index = len(self.chain)
+            leaf_index = len(self.pending)
+            
+            self.pending.append(encoded)
+            if self.pending_since is None:
+                self.pending_since = time.time()
+            
+            # Journal the transaction so it survives a restart before sealing
+            if self.store is not None:
+                location = self.store.append(TRANSACTION_RECORD_PREFIX + encoded + b"}", starts_block=leaf_index == 0)
+                if leaf_index == 0:
+                    self._pending_location = location
+            
+            block = None
+            if len(self.pending) >= self.block_size:
+                block = self.seal_pending()
+        
+        receipt = {
+            "status": "success",
+            "message": "Transaction queued for the next block",
+            "block_index": block_index,
+            "leaf_index": leaf_index,
+            "sealed": block is not None
+        }
+        if block is not None:
+            receipt["message"] = "Transaction added to blockchain"
+            receipt["block_hash"] = block.hash
+        
+        return receipt
+    
+    def seal_pending(self):
+        """Seal all queued transactions into one batch block"""
+        with self.lock:
+            if not self.pending:
+                return None
+            
+            new_block = BatchBlock(len(self.chain), time.time(), self.pending, self.get_latest_block().hash)
+            
+            # The transactions are already journaled, only the header is new
+            self._append_block(new_block, [new_block.to_record()], starts_block=False)
+            
+            self.pending = []
+            self.pending_since = None
+            self._pending_location = None
+            
+            return new_block
+    
+    def seal_if_due(self):
+        """Seal queued transactions once the oldest has waited seal_interval"""
+        with self.lock:
+            if self.pending and time.time() - self.pending_since >= self.seal_interval:
+                return self.seal_pending()
+        return None
+    
+    def is_chain_valid(self, full=False):
+        """
+        Validate the integrity of the blockchain
+        
+        By default only blocks appended since the last verified checkpoint
+        are re-hashed. With full=True every block is checked (full audit).
+        """
+        # Blocks appended while validating are left for the next call
+        end = len(self.chain)
+        start = 1
+        if not full and self.verified_height:
+            # The checkpointed block must still be the one that was verified,
+            # and its contents must still produce that hash
+            if self.verified_height >= end:
+                return False
+            checkpoint = self.chain[self.verified_height]
+            if checkpoint.hash != self.verified_hash or not checkpoint.verify(refresh=True):
+                return False
+            start = self.verified_height + 1
+        
+        for i in range(start, end):
             current_block = self.chain[i]
             previous_block = self.chain[i-1]
             
-            # Verify current block's hash
-            if current_block.hash != current_block.calculate_hash():
+            # Verify current block's hash (and Merkle root for batch blocks)
+            if not current_block.verify(refresh=full):
                 return False
             
             # Verify link to previous block
             if current_block.previous_hash != previous_block.hash:
                 return False
         
+        self.set_checkpoint(end - 1)
         return True
     
-    def get_transactions_by_user(self, user_id):
-        """Get all transactions involving a user"""
-        user_transactions = []
+    def set_checkpoint(self, height):
+        """Record that blocks up to height have been verified"""
+        if height == self.verified_height:
+            return
         
-        for block in self.chain[1:]:  # Skip genesis block
-            if "from_user" in block.transaction_data and block.transaction_data["from_user"] == user_id:
-                user_transactions.append(block.transaction_data)
+        self.verified_height = height
+        self.verified_hash = self.chain[height].hash
+        
+        if self.store is not None:
+            self.store.save_checkpoint(self.verified_height, self.verified_hash)
+    
+    def _append_block(self, block, records, starts_block=True):
+        """Add a new block to the chain, the store and the indexes"""
+        self.chain.append(block)
+        
+        segment_index = None
+        if self.store is not None:
+            locations = self.store.append_many(records, starts_block)
+            first = locations[0] if starts_block else self._pending_location or locations[0]
+            segment_index = self._track_block(block, first, locations[-1])
+        
+        self._index_block(block, segment_index)
+    
+    def _append_blocks(self, blocks):
+        """Add new single-transaction blocks to the chain, the store and the indexes at once"""
+        self.chain.extend(blocks)
+        
+        locations = None
+        if self.store is not None:
+            locations = self.store.append_many([block.to_record() for block in blocks])
+        
+        for position, block in enumerate(blocks):
+            segment_index = None
+            if locations is not None:
+                segment_index = self._track_block(block, locations[position], locations[position])
+            self._index_block(block, segment_index)
+    
+    def _track_block(self, block, first, last):
+        """
+        Record where a block is stored in the sidecar index of its segment
+        
+        first and last are the store locations of the block's first and last
+        records. When a block lands in a new segment the previous segment is
+        sealed and its sidecar index is written. Returns the sidecar index
+        the block's transactions should be added to, or None if the segment
+        can't be indexed (a block spanning two segments).
+        """
+        position, offset, _ = first
+        last_position, last_offset, last_length = last
+        
+        if last_position != self._segment_position:
+            if self._segment_index is not None:
+                self.store.save_segment_index(self._segment_position, self._segment_index)
+            self._segment_position = last_position
+            self._segment_index = _new_segment_index(block.index)
+        
+        if position != last_position:
+            self._segment_index = None
+        
+        if self._segment_index is not None:
+            self._segment_index["blocks"].append([offset, last_offset + last_length - offset])
+        
+        return self._segment_index
+    
+    def _index_block(self, block, segment_index=None):
+        """
+        Add a block's transactions to the secondary indexes (and to a segment's sidecar index)
+        
+        A store that indexes transactions itself gets them instead, and
+        nothing is kept in memory.
+        """
+        if self.store_indexed:
+            self.store.index_transactions([(block.index, leaf_index, transaction_data)
+                                           for leaf_index, transaction_data in enumerate(block.transactions)])
+            return
+        
+        targets = [(self.user_index, self.merchant_index, self.transaction_index)]
+        if segment_index is not None:
+            targets.append((segment_index["users"], segment_index["merchants"], segment_index["transactions"]))
+        
+        for leaf_index, transaction_data in enumerate(block.transactions):
+            location = (block.index, leaf_index)
+            
+            for user_index, merchant_index, transaction_index in targets:
+                if "from_user" in transaction_data:
+                    user_index.setdefault(transaction_data["from_user"], []).append(location)
+                if "to_merchant" in transaction_data:
+                    merchant_index.setdefault(transaction_data["to_merchant"], []).append(location)
+                if "transaction_id" in transaction_data:
+                    transaction_index[transaction_data["transaction_id"]] = location
+    
+    def _merge_segment_index(self, segment_index):
+        """Add the entries of a segment's sidecar index to the secondary indexes"""
+        for user_id, locations in segment_index["users"].items():
+            self.user_index.setdefault(user_id, []).extend(tuple(location) for location in locations)
+        for merchant_id, locations in segment_index["merchants"].items():
+            self.merchant_index.setdefault(merchant_id, []).extend(tuple(location) for location in locations)
+        for transaction_id, location in segment_index["transactions"].items():
+            self.transaction_index[transaction_id] = tuple(location)
+    
+    def _rebuild_indexes(self):
+        """Rebuild the secondary indexes from the chain"""
+        self.user_index = {}
+        self.merchant_index = {}
+        self.transaction_index = {}
         
-        return user_transactions
+        for block in self.chain[1:]:  # Skip genesis block
+            self._index_block(block)
+    
+    def _account_locations(self, user_id=None, merchant_id=None):
+        """Get the (block index, leaf index) of an account's transactions, oldest first"""
+        if self.store_indexed:
+            return self.store.find_locations(user_id, merchant_id)
+        if user_id:
+            return self.user_index.get(user_id, [])
+        return self.merchant_index.get(merchant_id, [])
+    
+    def get_transactions_by_user(self, user_id):
+        """Get all transactions involving a user"""
+        return [self.chain[block_index].get_transaction_at(leaf_index)
+                for block_index, leaf_index in self._account_locations(user_id=user_id)]
     
     def get_transactions_by_merchant(self, merchant_id):
         """Get all transactions involving a merchant"""
-        merchant_transactions = []
+        return [self.chain[block_index].get_transaction_at(leaf_index)
+                for block_index, leaf_index in self._account_locations(merchant_id=merchant_id)]
+    
+    def get_transaction_location(self, transaction_id):
+        """Get the (block index, leaf index) of a transaction, or None if it isn't on this chain"""
+        if self.store_indexed:
+            return self.store.find_location(transaction_id)
+        return self.transaction_index.get(transaction_id)
+    
+    def get_transaction(self, transaction_id):
+        """Get a transaction by its ID, or None if it isn't on this chain"""
+        location = self.get_transaction_location(transaction_id)
+        if location is None:
+            return None
+        block_index, leaf_index = location
+        return self.chain[block_index].get_transaction_at(leaf_index)
+    
+    def get_transaction_proof(self, transaction_id):
+        """
+        Build an inclusion proof for a transaction, or None if it isn't on this chain
         
-        for block in self.chain[1:]:  # Skip genesis block
-            if "to_merchant" in block.transaction_data and block.transaction_data["to_merchant"] == merchant_id:
-                merchant_transactions.append(block.transaction_data)
+        The proof holds the transaction, its Merkle path and the block header
+        and can be checked with verify_transaction_proof().
+        """
+        location = self.get_transaction_location(transaction_id)
+        if location is None:
+            return None
         
-        return merchant_transactions
+        block_index, leaf_index = location
+        block = self.chain[block_index]
+        
+        if isinstance(block, BatchBlock):
+            header = block.header()
+            path = merkle_path(block.leaf_hashes(), leaf_index)
+        else:
+            header = {
+                "index": block.index,
+                "timestamp": block.timestamp,
+                "previous_hash": block.previous_hash
+            }
+            path = []
+        
+        return {
+            "transaction": block.get_transaction_at(leaf_index),
+            "leaf_index": leaf_index,
+            "path": path,
+            "header": header,
+            "block_hash": block.hash
+        }
+    
+    def iter_transactions(self, user_id=None, merchant_id=None):
+        """
+        Yield transactions newest first, decoding blocks only as they are reached
+        
+        With user_id (or else merchant_id) only that account's transactions
+        are visited, through the secondary indexes (or the store's).
+        Transactions come in reverse chain order, which is descending
+        timestamp order as long as timestamps are assigned under self.lock
+        (see BankServer chains_locked). Each yielded transaction is a fresh
+        copy.
+        """
+        if not user_id and not merchant_id:
+            for block_index in range(len(self.chain) - 1, 0, -1):  # Skip genesis block
+                yield from reversed(self.chain[block_index].transactions)
+            return
+        
+        for block_index, leaf_index in reversed(self._account_locations(user_id, merchant_id)):
+            yield self.chain[block_index].get_transaction_at(leaf_index)
     
     def get_all_transactions(self):
         """Get all transactions in the blockchain"""
         transactions = []
         
         for block in self.chain[1:]:  # Skip genesis block
-            transactions.append(block.transaction_data)
+            transactions.extend(block.transactions)
         
         return transactions
     
@@ -154,14 +861,227 @@ class Blockchain:
         """Rebuild blockchain from serialized data"""
         # Clear existing chain
         self.chain = []
+        self.verified_height = 0
+        self.verified_hash = None
         
         # Rebuild each block
         for block_data in chain_data:
-            block = Block(
-                index=0,  # Placeholder, will be overwritten
-                timestamp=0,  # Placeholder, will be overwritten
-                transaction_data={},  # Placeholder, will be overwritten
-                previous_hash=""  # Placeholder, will be overwritten
-            )
-            block.rebuild_from_dict(block_data)
-            self.chain.append(block)
\ No newline at end of file
+            block_class = BatchBlock if "merkle_root" in block_data else Block
+            self.chain.append(block_class.from_dict(block_data))
+        
+        self._rebuild_indexes()
+    
+    def attach_store(self, store, lazy=False):
+        """
+        Attach append-only storage to the blockchain
+        
+        If the store already holds blocks the chain is rebuilt from them,
+        otherwise the current chain is written to it. Afterwards every new
+        block is appended to the store as it is added.
+        
+        With lazy=True sealed segments that have a sidecar index are not
+        decoded: only their indexes are loaded and their blocks are read
+        from a memory map when accessed (see LazyChain). The last segment,
+        which holds the chain tip, is always decoded.
+        """
+        self.store = store
+        self.store_indexed = store.indexes_transactions
+        self._segment_position = None
+        self._segment_index = None
+        
+        if store.is_empty():
+            self.user_index = {}
+            self.merchant_index = {}
+            self.transaction_index = {}
+            
+            for block in self.chain:
+                locations = store.append_many(block.to_records())
+                segment_index = self._track_block(block, locations[0], locations[-1])
+                if block.index:  # Genesis block isn't indexed
+                    self._index_block(block, segment_index)
+            
+            if self.pending:
+                records = [TRANSACTION_RECORD_PREFIX + encoded + b"}" for encoded in self.pending]
+                self._pending_location = store.append_many(records)[0]
+        else:
+            self._load_from_store(lazy)
+            self.verified_height, self.verified_hash = store.load_checkpoint()
+    
+    def _load_from_store(self, lazy):
+        """Rebuild the chain, pending transactions and indexes from the attached store"""
+        store = self.store
+        self.chain = LazyChain(store) if lazy else []
+        self.user_index = {}
+        self.merchant_index = {}
+        self.transaction_index = {}
+        
+        pending = []
+        pending_location = None
+        last = len(store.segments) - 1
+        
+        # A store that indexes transactions itself already has them, unless
+        # the ledger was written before it did and every block must be indexed
+        backfill = self.store_indexed and not store.has_transaction_index()
+        
+        for position in range(len(store.segments)):
+            if lazy and position < last and not pending and not backfill:
+                segment_index = store.load_segment_index(position)
+                if segment_index is not None and segment_index["first_block"] == len(self.chain):
+                    self.chain.map_segment(position, segment_index)
+                    if not self.store_indexed:
+                        self._merge_segment_index(segment_index)
+                    continue
+            
+            # Decode the segment, building its sidecar index along the way
+            contained = not pending  # False if a block spans segments
+            segment_index = _new_segment_index(len(self.chain))
+            blocks = []
+            
+            for record, offset in store.read_segment(position):
+                if record.startswith(TRANSACTION_RECORD_PREFIX):
+                    if not pending:
+                        pending_location = (position, offset, len(record) + 1)
+                    pending.append(record[len(TRANSACTION_RECORD_PREFIX):-1])
+                    continue
+                
+                block = Block.from_record(record)
+                start = (position, offset, len(record) + 1)
+                if isinstance(block, BatchBlock):
+                    # A batch header seals the transactions journaled before it
+                    block.transaction_records = pending[:block.tx_count]
+                    pending = pending[block.tx_count:]
+                    start = pending_location or start
+                    pending_location = None
+                
+                if start[0] != position:
+                    contained = False
+                segment_index["blocks"].append([start[1], offset + len(record) + 1 - start[1]])
+                if block.index and (backfill or not self.store_indexed):  # Genesis block isn't indexed
+                    self._index_block(block, segment_index)
+                blocks.append(block)
+            
+            if position < last:
+                contained = contained and not pending
+                if contained and store.load_segment_index(position) is None:
+                    store.save_segment_index(position, segment_index)
+                if contained and lazy:
+                    self.chain.map_segment(position, segment_index)
+                    continue
+            else:
+                self._segment_position = position
+                self._segment_index = segment_index if contained else None
+            
+            self.chain.extend(blocks)
+        
+        # Journaled transactions that were not sealed before shutdown
+        self.pending = pending
+        self.pending_since = time.time() if pending else None
+        self._pending_location = pending_location
+        self.verified_height = 0
+        self.verified_hash = None
+
+def _pack_block(block):
+    """Pack a block's fields into a tuple for sending to a worker process"""
+    if isinstance(block, BatchBlock):
+        return (block.index, block.timestamp, block.previous_hash, block.hash,
+                block._encoded, block.merkle_root, block.tx_count, block.transaction_records)
+    return (block.index, block.timestamp, block.previous_hash, block.hash, block._encoded)
+
+def _unpack_block(packed):
+    """Rebuild a block from _pack_block() output without re-hashing it"""
+    block_class = BatchBlock if len(packed) > 5 else Block
+    block = block_class.__new__(block_class)
+    block.index, block.timestamp, block.previous_hash, block.hash, block._encoded = packed[:5]
+    if block_class is BatchBlock:
+        block.merkle_root, block.tx_count, block.transaction_records = packed[5:]
+    return block
+
+def _verify_block_range(start, packed_blocks):
+    """
+    Fully verify a contiguous range of blocks
+    
+    Runs in a worker process. Returns the index of the first bad block in
+    the range (or None), plus the previous_hash of the first block and the
+    hash of the last block so the caller can check links between ranges.
+    """
+    previous_block = None
+    first_previous_hash = None
+    
+    for expected_index, packed in enumerate(packed_blocks, start):
+        block = _unpack_block(packed)
+        
+        if block.index != expected_index or not block.verify(refresh=True):
+            return expected_index, first_previous_hash, None
+        
+        if previous_block is None:
+            first_previous_hash = block.previous_hash
+        elif block.previous_hash != previous_block.hash:
+            return expected_index, first_previous_hash, None
+        
+        previous_block = block
+    
+    return None, first_previous_hash, previous_block.hash if previous_block else None
+
+def verify_chains_parallel(blockchains, workers=None, range_size=DEFAULT_VERIFY_RANGE_SIZE):
+    """
+    Fully audit several blockchains at once using a process pool
+    
+    Every chain is split into ranges of range_size blocks that are verified
+    concurrently. A range is only read and packed when it is submitted, and
+    at most VERIFY_RANGES_IN_FLIGHT ranges per worker are outstanding, so
+    memory stays bounded however long the chains are. Results are collected
+    in order and links across range boundaries are stitched together; once
+    a chain has a bad block its remaining ranges are skipped. Returns
+    {bank name: index of the first bad block, or None if the chain is
+    valid}. Valid chains get a new verification checkpoint.
+    """
+    workers = workers or os.cpu_count() or 1
+    chain_lengths = {bank_name: len(blockchain.chain) for bank_name, blockchain in blockchains.items()}
+    previous_hashes = {bank_name: blockchain.chain[0].hash for bank_name, blockchain in blockchains.items()}
+    results = {bank_name: None for bank_name in blockchains}
+    
+    def ranges():
+        """Yield (bank name, start) of each range, skipping chains already known to be bad"""
+        for bank_name in blockchains:
+            for start in range(1, chain_lengths[bank_name], range_size):  # Skip genesis block
+                if results[bank_name] is not None:
+                    break
+                yield bank_name, start
+    
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending_ranges = ranges()
+        in_flight = deque()  # (bank name, start, future) in submission order
+        
+        while True:
+            while len(in_flight) < VERIFY_RANGES_IN_FLIGHT * workers:
+                next_range = next(pending_ranges, None)
+                if next_range is None:
+                    break
+                bank_name, start = next_range
+                end = min(start + range_size, chain_lengths[bank_name])
+                packed_blocks = [_pack_block(block) for block in blockchains[bank_name].chain[start:end]]
+                in_flight.append((bank_name, start, pool.submit(_verify_block_range, start, packed_blocks)))
+            
+            if not in_flight:
+                break
+            
+            bank_name, start, future = in_flight.popleft()
+            if results[bank_name] is not None:
+                future.cancel()
+                continue
+            
+            range_bad, first_previous_hash, last_hash = future.result()
+            
+            # The first block of the range must link to the end of the previous range
+            if first_previous_hash is not None and first_previous_hash != previous_hashes[bank_name]:
+                range_bad = start
+            if range_bad is not None:
+                results[bank_name] = range_bad
+            else:
+                previous_hashes[bank_name] = last_hash
+    
+    for bank_name, blockchain in blockchains.items():
+        if results[bank_name] is None:
+            blockchain.set_checkpoint(chain_lengths[bank_name] - 1)
+    
+    return results
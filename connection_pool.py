@@ -0,0 +1,159 @@
+"""
+Client connection pooling for the UPI Payment Gateway System
+"""
+
+import socket
+import threading
+import time
+
+from protocol import send_frame, recv_frame, CONNECTION_IDLE_TIMEOUT
+
+# Idle connections kept open per (host, port)
+DEFAULT_MAX_SIZE = 8
+# Seconds an idle connection is kept; below the server's own idle timeout
+DEFAULT_IDLE_TIMEOUT = CONNECTION_IDLE_TIMEOUT / 2
+# Timeout for connecting and for waiting on a response, in seconds
+DEFAULT_SOCKET_TIMEOUT = 10
+
+class ConnectionPool:
+    """
+    Thread-safe pool of kept-alive connections keyed by (host, port).
+
+    request() borrows an idle connection (a hit) or opens a new one (a
+    miss), exchanges one framed message and returns the connection to the
+    pool. Connections idle for longer than idle_timeout are closed, pooled
+    connections are health-checked before reuse, and a request that could
+    not be sent on a reused connection is sent once more on a fresh one.
+    A request is never resent after it was sent in full, since the server
+    may already have processed it. At most max_size idle connections are
+    kept per address.
+    """
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 socket_timeout=DEFAULT_SOCKET_TIMEOUT):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.socket_timeout = socket_timeout
+
+        self._idle = {}  # (host, port) -> [(socket, time it was returned)], oldest first
+        self._lock = threading.Lock()
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reconnects = 0
+
+    def _connect(self, address):
+        """Open a new connection"""
+        sock = socket.create_connection(address, timeout=self.socket_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _is_healthy(self, sock):
+        """Check that the server hasn't closed an idle connection"""
+        try:
+            sock.setblocking(False)
+            try:
+                # An idle connection has nothing to read: EOF means it was
+                # closed, and stray data would be mistaken for a response
+                sock.recv(1, socket.MSG_PEEK)
+                return False
+            except BlockingIOError:
+                return True
+            finally:
+                sock.settimeout(self.socket_timeout)
+        except OSError:
+            return False
+
+    def _evict_expired(self, now):
+        """Close idle connections that have been unused for too long (lock held)"""
+        for address, connections in self._idle.items():
+            while connections and now - connections[0][1] > self.idle_timeout:
+                connections.pop(0)[0].close()
+                self.evictions += 1
+
+    def acquire(self, address):
+        """Get a healthy connection to address, returning (socket, reused)"""
+        while True:
+            with self._lock:
+                self._evict_expired(time.monotonic())
+                connections = self._idle.get(address)
+                if not connections:
+                    self.misses += 1
+                    break
+                sock = connections.pop()[0]  # Most recently used first
+
+            if self._is_healthy(sock):
+                with self._lock:
+                    self.hits += 1
+                return sock, True
+
+            sock.close()
+            with self._lock:
+                self.evictions += 1
+
+        return self._connect(address), False
+
+    def release(self, address, sock):
+        """Return a connection to the pool, closing it if the pool is full"""
+        with self._lock:
+            now = time.monotonic()
+            self._evict_expired(now)
+            connections = self._idle.setdefault(address, [])
+            if len(connections) < self.max_size:
+                connections.append((sock, now))
+                return
+
+        sock.close()
+
+    def request(self, address, message):
+        """Send a message to address over a pooled connection and return the response"""
+        sock, reused = self.acquire(address)
+
+        try:
+            try:
+                send_frame(sock, message)
+            except socket.timeout:
+                raise
+            except OSError:
+                if not reused:
+                    raise
+
+                # The pooled connection was already dead: the frame was not
+                # sent in full, so the server cannot have acted on it
+                sock.close()
+                with self._lock:
+                    self.reconnects += 1
+                sock = self._connect(address)
+                send_frame(sock, message)
+
+            # Once the request is out it may have been processed, so a
+            # failure from here on is not retried (see send_message retries)
+            response = recv_frame(sock)
+            if response is None:
+                raise ConnectionError("Connection closed by server")
+        except:
+            sock.close()
+            raise
+
+        self.release(address, sock)
+        return response
+
+    def stats(self):
+        """Get the pool counters"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "reconnects": self.reconnects,
+                "idle": sum(len(connections) for connections in self._idle.values())
+            }
+
+    def close(self):
+        """Close every idle connection"""
+        with self._lock:
+            for connections in self._idle.values():
+                for sock, returned in connections:
+                    sock.close()
+            self._idle = {}
@@ -0,0 +1,86 @@
+"""
+Group commit for durable writes in the UPI Payment Gateway System
+"""
+
+import threading
+import time
+
+# Default time to wait for more writers before syncing a batch, in seconds
+DEFAULT_COMMIT_WINDOW = 0.002
+# Default number of waiting writers that triggers a sync straight away
+DEFAULT_MAX_BATCH = 64
+
+class GroupCommitter:
+    """
+    Batches durability requests from concurrent writers into one sync.
+
+    Writers append their records as usual (without syncing) and then call
+    commit(), which blocks until a sync that started after the call has
+    completed. A background thread collects waiting writers for up to
+    `window` seconds or until `max_batch` are waiting, then runs `sync_fn`
+    once for the whole batch.
+    """
+    def __init__(self, sync_fn, window=DEFAULT_COMMIT_WINDOW, max_batch=DEFAULT_MAX_BATCH):
+        self.sync_fn = sync_fn
+        self.window = window
+        self.max_batch = max_batch
+
+        self._cond = threading.Condition()
+        self._requested = 0  # Tickets handed out to writers
+        self._durable = 0  # Highest ticket covered by a completed sync
+        self._failures = []  # [(first ticket, last ticket, error)] of recent failed batches
+
+        # Statistics
+        self.batches = 0
+        self.commits = 0
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def commit(self):
+        """Block until everything written before this call is durable"""
+        with self._cond:
+            self._requested += 1
+            ticket = self._requested
+            self._cond.notify_all()
+
+            while self._durable < ticket:
+                self._cond.wait()
+
+            for first, last, error in self._failures:
+                if first <= ticket <= last:
+                    raise IOError(f"Group commit failed: {error}")
+
+    def _run(self):
+        """Collect waiting writers into batches and sync each batch once"""
+        while True:
+            with self._cond:
+                while self._requested == self._durable:
+                    self._cond.wait()
+
+                # Give other writers a chance to join the batch
+                deadline = time.monotonic() + self.window
+                while self._requested - self._durable < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                first = self._durable + 1
+                last = self._requested
+
+            error = None
+            try:
+                self.sync_fn()
+            except Exception as e:
+                print(f"Error syncing commit batch: {e}")
+                error = e
+
+            with self._cond:
+                if error is not None:
+                    self._failures = self._failures[-15:] + [(first, last, error)]
+                self._durable = last
+                self.batches += 1
+                self.commits += last - first + 1
+                self._cond.notify_all()
@@ -0,0 +1,243 @@
+"""
+Append-only segmented ledger storage for the UPI Payment Gateway System
+"""
+
+import json
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+# Number of records written to a segment before a new one is started
+DEFAULT_SEGMENT_SIZE = 10000
+# Sealed segments kept memory-mapped at once; each map holds a file descriptor
+DEFAULT_MAX_MAPS = 32
+
+class SegmentedLedgerStore:
+    """
+    Append-only storage for a single bank's blockchain.
+
+    Blocks are written as encoded JSON records, one per line, into rolling
+    segment files (a batch block is its journaled transactions followed by
+    a header record). A small index file lists the segments and the number
+    of the first record in each, so adding a block only ever appends that
+    block's records. When a segment is sealed a sidecar index with the byte
+    offset of every block in it can be stored next to it, so historical
+    blocks can be read on demand from a memory map instead of at startup.
+    """
+    # Transaction indexes are kept in memory by Blockchain (see SQLiteLedgerStore)
+    indexes_transactions = False
+
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE, max_maps=DEFAULT_MAX_MAPS):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_maps = max_maps
+        self.index_path = os.path.join(directory, "index.json")
+        self.checkpoint_path = os.path.join(directory, "checkpoint.json")
+
+        self.segments = []  # [{"file": segment file name, "start": number of its first record}]
+        self.record_count = 0
+
+        # Active (last) segment state
+        self._active_file = None
+        self._active_count = 0
+        self._active_size = 0
+        self._lock = threading.Lock()
+        # Segment position -> read-only mmap of a sealed segment, least recently used first
+        self._maps = OrderedDict()
+        self._maps_lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        """Load the segment index if it exists"""
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                self.segments = json.load(f)["segments"]
+
+    def _save_index(self):
+        """Atomically rewrite the segment index"""
+        self._atomic_write_json(self.index_path, {"segment_size": self.segment_size, "segments": self.segments})
+
+    def _atomic_write_json(self, path, data):
+        """Write JSON to a temporary file and move it into place"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def load_checkpoint(self):
+        """Get the (height, block hash) of the last verified block, or (0, None)"""
+        if not os.path.exists(self.checkpoint_path):
+            return 0, None
+        with open(self.checkpoint_path, "r") as f:
+            checkpoint = json.load(f)
+        return checkpoint["height"], checkpoint["hash"]
+
+    def save_checkpoint(self, height, block_hash):
+        """Persist the height and hash of the last verified block"""
+        self._atomic_write_json(self.checkpoint_path, {"height": height, "hash": block_hash})
+
+    def _segment_path(self, segment):
+        """Get the full path of a segment file"""
+        return os.path.join(self.directory, segment["file"])
+
+    def is_empty(self):
+        """Check whether the store holds any records"""
+        return not self.segments
+
+    def read_segment(self, position):
+        """
+        Read the records of one segment as (record, byte offset) pairs
+
+        Reading the last (active) segment truncates a torn trailing record
+        and sets up the counters needed to append after it.
+        """
+        segment = self.segments[position]
+        path = self._segment_path(segment)
+        is_last = position == len(self.segments) - 1
+        records = []
+        good_offset = 0
+
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # Partially written record from an interrupted append
+                    records.append((line[:-1], good_offset))
+                    good_offset += len(line)
+
+            if is_last and good_offset != os.path.getsize(path):
+                print(f"Repairing torn record in ledger segment {path}")
+                with open(path, "r+b") as f:
+                    f.truncate(good_offset)
+
+        if is_last:
+            self._active_count = len(records)
+            self.record_count = segment["start"] + len(records)
+
+        return records
+
+    def read_range(self, position, offset, length):
+        """Read raw bytes from a segment; sealed segments are memory-mapped"""
+        if position == len(self.segments) - 1:
+            # The active segment is still growing, read it directly
+            with self._lock:
+                if self._active_file is not None:
+                    self._active_file.flush()
+            with open(self._segment_path(self.segments[position]), "rb") as f:
+                f.seek(offset)
+                return f.read(length)
+
+        # Held while reading so a map isn't closed under another reader
+        with self._maps_lock:
+            mapping = self._maps.get(position)
+            if mapping is None:
+                with open(self._segment_path(self.segments[position]), "rb") as f:
+                    mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[position] = mapping
+                while len(self._maps) > self.max_maps:
+                    self._maps.popitem(last=False)[1].close()
+            else:
+                self._maps.move_to_end(position)
+            return mapping[offset:offset + length]
+
+    def _segment_index_path(self, position):
+        """Get the path of the sidecar index of a segment"""
+        return self._segment_path(self.segments[position])[:-len(".jsonl")] + ".idx.json"
+
+    def load_segment_index(self, position):
+        """Load the sidecar index written when a segment was sealed, or None"""
+        path = self._segment_index_path(position)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except ValueError:
+            return None
+
+    def save_segment_index(self, position, segment_index):
+        """Write the sidecar index of a sealed segment"""
+        self._atomic_write_json(self._segment_index_path(position), segment_index)
+
+    def _open_active(self, starts_block):
+        """Open the active segment for appending, starting a new one when full"""
+        if self.segments and (self._active_count < self.segment_size or not starts_block):
+            if self._active_file is None:
+                path = self._segment_path(self.segments[-1])
+                self._active_file = open(path, "ab")
+                self._active_size = os.path.getsize(path)
+            return self._active_file
+
+        # Roll over to a new segment, only ever between blocks
+        if self._active_file is not None:
+            self._active_file.flush()
+            os.fsync(self._active_file.fileno())
+            self._active_file.close()
+
+        segment = {"file": f"segment_{self.record_count:012d}.jsonl", "start": self.record_count}
+        self.segments.append(segment)
+        self._save_index()
+
+        self._active_file = open(self._segment_path(segment), "ab")
+        self._active_count = 0
+        self._active_size = 0
+        return self._active_file
+
+    def append(self, record, starts_block=True):
+        """Append a single encoded record and return its (segment, offset, length)"""
+        return self.append_many([record], starts_block)[0]
+
+    def append_many(self, records, starts_block=True):
+        """
+        Append encoded records (bytes without a newline) in order
+
+        A new segment is only started before the first record, and only if
+        starts_block is set, so the records of one block never span two
+        segments. Returns the (segment position, byte offset, length) of
+        each record.
+        """
+        locations = []
+
+        with self._lock:
+            for record in records:
+                f = self._open_active(starts_block)
+                starts_block = False
+                f.write(record + b"\n")
+                locations.append((len(self.segments) - 1, self._active_size, len(record) + 1))
+                self._active_size += len(record) + 1
+                self._active_count += 1
+                self.record_count += 1
+
+            if self._active_file is not None:
+                self._active_file.flush()
+
+        return locations
+
+    def flush(self):
+        """Flush buffered records to the operating system (see sync() for durability)"""
+        with self._lock:
+            if self._active_file is not None:
+                self._active_file.flush()
+
+    def sync(self):
+        """Flush and fsync the active segment so appended records are durable"""
+        with self._lock:
+            if self._active_file is not None:
+                self._active_file.flush()
+                os.fsync(self._active_file.fileno())
+
+    def close(self):
+        """Close the active segment and any memory-mapped segments"""
+        with self._lock:
+            if self._active_file is not None:
+                self._active_file.close()
+                self._active_file = None
+        with self._maps_lock:
+            for mapping in self._maps.values():
+                mapping.close()
+            self._maps.clear()
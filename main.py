@@ -86,7 +86,7 @@ def start_bank_server(host):
     
     # Bind to all interfaces for incoming connections
     bank_server.server_socket.bind(('0.0.0.0', common_utils.PORT_BANK))
-    bank_server.server_socket.listen(5)
+    bank_server.server_socket.listen(common_utils.BANK_SETTINGS.get("listen_backlog", 5))
     
     # Start the server
     print(f"Bank Server ready to accept connections on {host}:{common_utils.PORT_BANK}")
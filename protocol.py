@@ -0,0 +1,105 @@
+"""
+Framed message protocol for the UPI Payment Gateway System
+"""
+
+import asyncio
+import json
+import socket
+import struct
+
+# Every message is a 4-byte big-endian payload length followed by JSON
+FRAME_HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+# Seconds a kept-alive connection may sit idle before the server closes it
+CONNECTION_IDLE_TIMEOUT = 60
+
+def encode_frame(message):
+    """Encode a message as a length-prefixed frame"""
+    payload = json.dumps(message).encode()
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+def send_frame(sock, message):
+    """Send one message over a socket"""
+    sock.sendall(encode_frame(message))
+
+def _recv_exactly(sock, size):
+    """Read exactly size bytes, or None if the connection was closed first"""
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1024 * 1024))
+        if not chunk:
+            if remaining == size:
+                return None
+            raise ConnectionError("Connection closed in the middle of a message")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+def _check_size(size):
+    """Reject frames that are too large to be a valid message"""
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"Message of {size} bytes exceeds the maximum frame size")
+
+def recv_frame(sock):
+    """Receive one message from a socket, or None if the peer closed the connection"""
+    header = _recv_exactly(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+
+    size, = FRAME_HEADER.unpack(header)
+    _check_size(size)
+    payload = _recv_exactly(sock, size) if size else b""
+    if payload is None:
+        raise ConnectionError("Connection closed in the middle of a message")
+
+    return json.loads(payload)
+
+async def read_frame(reader):
+    """Read one message from an asyncio stream, or None if the peer closed the connection"""
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise ConnectionError("Connection closed in the middle of a message")
+
+    size, = FRAME_HEADER.unpack(header)
+    _check_size(size)
+    return json.loads(await reader.readexactly(size))
+
+def serve_connection(client_socket, handle_request, error_prefix="Server error"):
+    """
+    Answer framed requests on a connection until the client closes it
+
+    handle_request maps a request dict to a response dict. A failing
+    request gets an error response and the connection stays open; the
+    connection is closed after CONNECTION_IDLE_TIMEOUT seconds without a
+    request.
+    """
+    try:
+        client_socket.settimeout(CONNECTION_IDLE_TIMEOUT)
+
+        while True:
+            request = recv_frame(client_socket)
+            if request is None:
+                break
+
+            try:
+                response = handle_request(request)
+            except Exception as e:
+                print(f"Error handling client: {e}")
+                response = {"status": "error", "message": f"{error_prefix}: {str(e)}"}
+
+            send_frame(client_socket, response)
+    except socket.timeout:
+        pass  # Idle keep-alive connection
+    except Exception as e:
+        print(f"Error handling client: {e}")
+        try:
+            send_frame(client_socket, {"status": "error", "message": f"{error_prefix}: {str(e)}"})
+        except:
+            pass
+    finally:
+        client_socket.close()
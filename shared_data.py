@@ -9,6 +9,7 @@ import shutil
 import socket
 import time
 import threading
+from protocol import send_frame, recv_frame, serve_connection
 
 # Define shared data directory
 SHARED_DATA_DIR = 'shared_data'
@@ -88,47 +89,35 @@ class DataSyncServer:
                     print("Data sync server error, restarting...")
                     time.sleep(1)
     
-    def _handle_client(self, client_socket):
-        """Handle data sync client connection"""
-        try:
-            # Receive request
-            data = client_socket.recv(4096).decode()
-            request = json.loads(data)
-            
-            response = {"status": "error", "message": "Unknown request"}
-            
-            if request["action"] == "get_data":
-                # Client is requesting data
-                if "file_name" in request:
-                    file_name = request["file_name"]
-                    data = load_shared_data(file_name)
-                    if data is not None:
-                        response = {"status": "success", "data": data}
-                    else:
-                        response = {"status": "error", "message": f"File not found: {file_name}"}
-            
-            elif request["action"] == "save_data":
-                # Client is sending data to save
-                if "file_name" in request and "data" in request:
-                    file_name = request["file_name"]
-                    data = request["data"]
-                    if save_shared_data(file_name, data):
-                        response = {"status": "success", "message": f"Data saved: {file_name}"}
-                    else:
-                        response = {"status": "error", "message": f"Error saving data: {file_name}"}
-            
-            # Send response
-            client_socket.sendall(json.dumps(response).encode())
+    def _handle_request(self, request):
+        """Process a decoded data sync request and return the response"""
+        response = {"status": "error", "message": "Unknown request"}
         
-        except Exception as e:
-            print(f"Error handling data sync client: {e}")
-            try:
-                error_response = {"status": "error", "message": str(e)}
-                client_socket.sendall(json.dumps(error_response).encode())
-            except:
-                pass
-        finally:
-            client_socket.close()
+        if request["action"] == "get_data":
+            # Client is requesting data
+            if "file_name" in request:
+                file_name = request["file_name"]
+                data = load_shared_data(file_name)
+                if data is not None:
+                    response = {"status": "success", "data": data}
+                else:
+                    response = {"status": "error", "message": f"File not found: {file_name}"}
+        
+        elif request["action"] == "save_data":
+            # Client is sending data to save
+            if "file_name" in request and "data" in request:
+                file_name = request["file_name"]
+                data = request["data"]
+                if save_shared_data(file_name, data):
+                    response = {"status": "success", "message": f"Data saved: {file_name}"}
+                else:
+                    response = {"status": "error", "message": f"Error saving data: {file_name}"}
+        
+        return response
+    
+    def _handle_client(self, client_socket):
+        """Handle data sync client connection, answering requests until the client disconnects"""
+        serve_connection(client_socket, self._handle_request, "Data sync error")
 
 def sync_data_with_server(host, port, action, file_name, data=None):
     """Sync data with a remote server"""
@@ -146,11 +135,13 @@ def sync_data_with_server(host, port, action, file_name, data=None):
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
             sock.settimeout(5)  # 5 second timeout
             sock.connect((host, port))
-            sock.sendall(json.dumps(request).encode())
+            send_frame(sock, request)
             
             # Get response
-            response = sock.recv(4096).decode()
-            return json.loads(response)
+            response = recv_frame(sock)
+            if response is None:
+                raise ConnectionError("Connection closed by server")
+            return response
     
     except Exception as e:
         print(f"Error syncing data with server: {e}")
@@ -0,0 +1,423 @@
+"""
+SQLite storage for bank accounts and blockchain ledgers
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from account_store import AccountStore
+from ledger_store import DEFAULT_SEGMENT_SIZE
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    uid TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS merchants (
+    mid TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS mmids (
+    mmid TEXT PRIMARY KEY,
+    uid TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ledger_records (
+    bank TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    record BLOB NOT NULL,
+    PRIMARY KEY (bank, offset)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ledger_segments (
+    bank TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    first_offset INTEGER NOT NULL,
+    segment_index TEXT,
+    PRIMARY KEY (bank, position)
+);
+CREATE TABLE IF NOT EXISTS ledger_transactions (
+    bank TEXT NOT NULL,
+    block_index INTEGER NOT NULL,
+    leaf_index INTEGER NOT NULL,
+    transaction_id TEXT NOT NULL,
+    from_user TEXT,
+    to_merchant TEXT,
+    amount REAL,
+    timestamp REAL,
+    PRIMARY KEY (bank, block_index, leaf_index)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ledger_checkpoints (
+    bank TEXT PRIMARY KEY,
+    height INTEGER NOT NULL,
+    hash TEXT
+);
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idempotency_expires ON idempotency_keys (expires);
+CREATE INDEX IF NOT EXISTS ledger_transactions_id ON ledger_transactions (transaction_id, bank);
+CREATE INDEX IF NOT EXISTS ledger_transactions_user ON ledger_transactions (bank, from_user, timestamp);
+CREATE INDEX IF NOT EXISTS ledger_transactions_merchant ON ledger_transactions (bank, to_merchant, timestamp);
+"""
+
+class SQLiteDatabase:
+    """
+    Shared SQLite connection in WAL mode.
+
+    Writes are not committed one by one: they accumulate in an open SQLite
+    transaction and sync() commits everything written so far, so one group
+    commit costs one fsync. A payment wraps its writes in transaction(),
+    and sync() waits for running payments to finish before committing, so
+    the rows of a payment are always committed together.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=FULL")
+        self.connection.executescript(SCHEMA)
+
+        self.lock = threading.RLock()  # Serializes use of the connection
+        self._state = threading.Condition()
+        self._writers = 0  # Payments currently writing
+        self._syncing = 0  # Syncs waiting for those payments to finish
+
+    def write(self, statement, parameters=()):
+        """Run one write statement in the open transaction"""
+        with self.lock:
+            self.begin()
+            self.connection.execute(statement, parameters)
+
+    def write_many(self, statement, rows):
+        """Run a write statement for each row in the open transaction"""
+        with self.lock:
+            self.begin()
+            self.connection.executemany(statement, rows)
+
+    def query(self, statement, parameters=()):
+        """Run a query and return all rows"""
+        with self.lock:
+            return self.connection.execute(statement, parameters).fetchall()
+
+    def begin(self):
+        """Open a transaction for the following writes if none is open (lock held)"""
+        if not self.connection.in_transaction:
+            self.connection.execute("BEGIN")
+
+    @contextmanager
+    def transaction(self):
+        """Keep sync() from committing until the writes in the with block are done"""
+        with self._state:
+            while self._syncing:
+                self._state.wait()
+            self._writers += 1
+        try:
+            yield
+        finally:
+            with self._state:
+                self._writers -= 1
+                self._state.notify_all()
+
+    def sync(self):
+        """Commit everything written so far"""
+        with self._state:
+            self._syncing += 1
+            while self._writers:
+                self._state.wait()
+        try:
+            with self.lock:
+                if self.connection.in_transaction:
+                    self.connection.execute("COMMIT")
+        finally:
+            with self._state:
+                self._syncing -= 1
+                self._state.notify_all()
+
+    def checkpoint(self):
+        """Commit and fold the write-ahead log back into the database file"""
+        self.sync()
+        with self.lock:
+            self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        """Commit and close the connection"""
+        self.sync()
+        with self.lock:
+            self.connection.close()
+
+class SQLiteAccountStore:
+    """
+    User and merchant accounts kept in SQLite.
+
+    Has the same interface as AccountStore. Each account is one row holding
+    the full account as JSON, and MMIDs are looked up in their own table.
+    Payment responses stored for idempotency keys are kept in their own
+    table until they expire. On first start the accounts of the JSON files
+    are imported.
+    """
+    def __init__(self, database):
+        self.database = database
+
+    def load(self):
+        """Load all accounts, importing the JSON account files into an empty database"""
+        users = {uid: json.loads(data) for uid, data in self.database.query("SELECT uid, data FROM users")}
+        merchants = {mid: json.loads(data) for mid, data in self.database.query("SELECT mid, data FROM merchants")}
+
+        if not users and not merchants and (os.path.exists("users.json") or os.path.exists("merchants.json")):
+            json_store = AccountStore()
+            users, merchants = json_store.load()
+            json_store.close()
+
+            for uid, user in users.items():
+                self.log_user(uid, user)
+            for mid, merchant in merchants.items():
+                self.log_merchant(mid, merchant)
+            for key, entry in json_store.idempotency_entries().items():
+                self.log_idempotency(key, entry["response"], entry["expires"])
+            self.database.sync()
+            print(f"Imported {len(users)} users and {len(merchants)} merchants into {self.database.path}")
+        elif users and not self.database.query("SELECT 1 FROM mmids LIMIT 1"):
+            # Database written before MMIDs had their own table
+            self.database.write_many(
+                "INSERT OR IGNORE INTO mmids (mmid, uid) VALUES (?, ?)",
+                [(user["mmid"], uid) for uid, user in users.items() if "mmid" in user]
+            )
+
+        return users, merchants
+
+    def log_user(self, uid, user):
+        """Store the current state of a user account"""
+        with self.database.lock:
+            self.database.write("INSERT OR REPLACE INTO users (uid, data) VALUES (?, ?)", (uid, json.dumps(user)))
+            if "mmid" in user:
+                # An MMID never changes, so only a new user adds a row
+                self.database.write("INSERT OR IGNORE INTO mmids (mmid, uid) VALUES (?, ?)", (user["mmid"], uid))
+
+    def find_uid(self, mmid):
+        """Get the ID of the user with an MMID, or None"""
+        rows = self.database.query("SELECT uid FROM mmids WHERE mmid = ?", (mmid,))
+        return rows[0][0] if rows else None
+
+    def log_merchant(self, mid, merchant):
+        """Store the current state of a merchant account"""
+        self.database.write("INSERT OR REPLACE INTO merchants (mid, data) VALUES (?, ?)", (mid, json.dumps(merchant)))
+
+    def log_idempotency(self, key, response, expires):
+        """Store the response of a payment made with an idempotency key, kept until expires"""
+        self.database.write(
+            "INSERT OR REPLACE INTO idempotency_keys (key, response, expires) VALUES (?, ?, ?)",
+            (key, json.dumps(response), expires)
+        )
+
+    def idempotency_entries(self):
+        """Get the stored payment responses that have not expired, as key -> {response, expires}"""
+        rows = self.database.query(
+            "SELECT key, response, expires FROM idempotency_keys WHERE expires > ? ORDER BY expires", (time.time(),)
+        )
+        return {key: {"response": json.loads(response), "expires": expires} for key, response, expires in rows}
+
+    def flush(self):
+        """Nothing is buffered outside SQLite"""
+        pass
+
+    def sync(self):
+        """Commit stored accounts"""
+        self.database.sync()
+
+    def snapshot(self, background=False):
+        """Drop expired payment responses and checkpoint the SQLite write-ahead log"""
+        self.database.write("DELETE FROM idempotency_keys WHERE expires <= ?", (time.time(),))
+        self.database.checkpoint()
+
+    def close(self):
+        """Accounts are closed together with the database"""
+        pass
+
+class SQLiteLedgerStore:
+    """
+    Ledger records of a single bank's blockchain kept in SQLite.
+
+    Has the same interface as SegmentedLedgerStore, so Blockchain stores
+    and loads blocks the same way with either backend. Each record is a
+    row keyed by the byte offset it would have in one continuous ledger
+    file, and segments are ranges of up to segment_size rows that start
+    between blocks.
+
+    The store also keeps the transaction indexes: Blockchain hands it each
+    block's transactions through index_transactions() and looks them up
+    by ID, user or merchant with SQL instead of holding them in memory.
+    """
+    indexes_transactions = True
+
+    def __init__(self, database, bank_name, segment_size=DEFAULT_SEGMENT_SIZE):
+        self.database = database
+        self.bank_name = bank_name
+        self.segment_size = segment_size
+
+        rows = database.query(
+            "SELECT start, first_offset FROM ledger_segments WHERE bank = ? ORDER BY position", (bank_name,)
+        )
+        self.segments = [{"start": start, "offset": offset} for start, offset in rows]
+
+        self.record_count = 0
+        self._size = 0  # Offset of the next record
+        self._active_count = 0
+        if self.segments:
+            active = self.segments[-1]
+            self._active_count, = database.query(
+                "SELECT COUNT(*) FROM ledger_records WHERE bank = ? AND offset >= ?", (bank_name, active["offset"])
+            )[0]
+            self.record_count = active["start"] + self._active_count
+            last = database.query(
+                "SELECT offset + LENGTH(record) + 1 FROM ledger_records WHERE bank = ? ORDER BY offset DESC LIMIT 1",
+                (bank_name,)
+            )
+            self._size = last[0][0] if last else active["offset"]
+
+    def is_empty(self):
+        """Check whether the store holds any records"""
+        return not self.segments
+
+    def _segment_end(self, position):
+        """Get the offset just past the last record of a segment"""
+        if position + 1 < len(self.segments):
+            return self.segments[position + 1]["offset"]
+        return self._size
+
+    def read_segment(self, position):
+        """Read the records of one segment as (record, offset) pairs"""
+        rows = self.database.query(
+            "SELECT record, offset FROM ledger_records WHERE bank = ? AND offset >= ? AND offset < ? ORDER BY offset",
+            (self.bank_name, self.segments[position]["offset"], self._segment_end(position))
+        )
+        return [(bytes(record), offset) for record, offset in rows]
+
+    def read_range(self, position, offset, length):
+        """Read the newline-terminated records in length bytes starting at offset"""
+        rows = self.database.query(
+            "SELECT record FROM ledger_records WHERE bank = ? AND offset >= ? AND offset < ? ORDER BY offset",
+            (self.bank_name, offset, offset + length)
+        )
+        return b"".join(bytes(record) + b"\n" for record, in rows)
+
+    def load_segment_index(self, position):
+        """Load the index stored when a segment was sealed, or None"""
+        rows = self.database.query(
+            "SELECT segment_index FROM ledger_segments WHERE bank = ? AND position = ?",
+            (self.bank_name, position)
+        )
+        if not rows or rows[0][0] is None:
+            return None
+        return json.loads(rows[0][0])
+
+    def save_segment_index(self, position, segment_index):
+        """Store the index of a sealed segment"""
+        self.database.write(
+            "UPDATE ledger_segments SET segment_index = ? WHERE bank = ? AND position = ?",
+            (json.dumps(segment_index), self.bank_name, position)
+        )
+
+    def load_checkpoint(self):
+        """Get the (height, block hash) of the last verified block, or (0, None)"""
+        rows = self.database.query("SELECT height, hash FROM ledger_checkpoints WHERE bank = ?", (self.bank_name,))
+        return rows[0] if rows else (0, None)
+
+    def save_checkpoint(self, height, block_hash):
+        """Persist the height and hash of the last verified block"""
+        self.database.write(
+            "INSERT OR REPLACE INTO ledger_checkpoints (bank, height, hash) VALUES (?, ?, ?)",
+            (self.bank_name, height, block_hash)
+        )
+
+    def has_transaction_index(self):
+        """Check whether any transaction of this bank has been indexed"""
+        return bool(self.database.query(
+            "SELECT 1 FROM ledger_transactions WHERE bank = ? LIMIT 1", (self.bank_name,)
+        ))
+
+    def index_transactions(self, transactions):
+        """Index (block index, leaf index, transaction data) entries of newly stored blocks"""
+        self.database.write_many(
+            "INSERT OR REPLACE INTO ledger_transactions "
+            "(bank, block_index, leaf_index, transaction_id, from_user, to_merchant, amount, timestamp) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(self.bank_name, block_index, leaf_index, transaction_data.get("transaction_id"),
+              transaction_data.get("from_user"), transaction_data.get("to_merchant"),
+              transaction_data.get("amount"), transaction_data.get("timestamp"))
+             for block_index, leaf_index, transaction_data in transactions]
+        )
+
+    def find_location(self, transaction_id):
+        """Get the (block index, leaf index) of a transaction, or None"""
+        rows = self.database.query(
+            "SELECT block_index, leaf_index FROM ledger_transactions WHERE transaction_id = ? AND bank = ?",
+            (transaction_id, self.bank_name)
+        )
+        return rows[0] if rows else None
+
+    def find_locations(self, user_id=None, merchant_id=None):
+        """Get the (block index, leaf index) of an account's transactions, oldest first"""
+        column, account_id = ("from_user", user_id) if user_id else ("to_merchant", merchant_id)
+        return self.database.query(
+            f"SELECT block_index, leaf_index FROM ledger_transactions WHERE bank = ? AND {column} = ? "
+            "ORDER BY timestamp, block_index, leaf_index",
+            (self.bank_name, account_id)
+        )
+
+    def append(self, record, starts_block=True):
+        """Append a single encoded record and return its (segment, offset, length)"""
+        return self.append_many([record], starts_block)[0]
+
+    def append_many(self, records, starts_block=True):
+        """
+        Append encoded records in order
+
+        As with SegmentedLedgerStore a new segment is only started before
+        the first record, and only if starts_block is set. Returns the
+        (segment position, offset, length) of each record.
+        """
+        if not records:
+            return []
+
+        with self.database.lock:
+            if not self.segments or (starts_block and self._active_count >= self.segment_size):
+                self.database.write(
+                    "INSERT INTO ledger_segments (bank, position, start, first_offset) VALUES (?, ?, ?, ?)",
+                    (self.bank_name, len(self.segments), self.record_count, self._size)
+                )
+                self.segments.append({"start": self.record_count, "offset": self._size})
+                self._active_count = 0
+
+            position = len(self.segments) - 1
+            locations = []
+            for record in records:
+                locations.append((position, self._size, len(record) + 1))
+                self._size += len(record) + 1
+
+            self.database.write_many(
+                "INSERT INTO ledger_records (bank, offset, record) VALUES (?, ?, ?)",
+                [(self.bank_name, offset, record) for (_, offset, _), record in zip(locations, records)]
+            )
+
+            self.record_count += len(records)
+            self._active_count += len(records)
+
+        return locations
+
+    def flush(self):
+        """Nothing is buffered outside SQLite"""
+        pass
+
+    def sync(self):
+        """Commit appended records"""
+        self.database.sync()
+
+    def close(self):
+        """Records are closed together with the database"""
+        pass
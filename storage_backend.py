@@ -0,0 +1,127 @@
+"""
+Pluggable storage backends for the bank server
+"""
+
+import os
+from contextlib import contextmanager
+
+from account_store import AccountStore
+from ledger_store import SegmentedLedgerStore
+from sqlite_store import SQLiteDatabase, SQLiteAccountStore, SQLiteLedgerStore
+
+class StorageBackend:
+    """
+    Where the bank server keeps its accounts and blockchains.
+
+    A backend hands out one account store (load, log_user, log_merchant,
+    find_uid, snapshot; see AccountStore) and a ledger store per bank (see
+    SegmentedLedgerStore). Writes of one payment are made inside
+    transaction() so that sync() makes them durable all together.
+    """
+    name = None
+
+    def __init__(self):
+        self.account_store = None
+        self.ledger_stores = {}
+
+    def open_account_store(self):
+        """Get the account store"""
+        raise NotImplementedError
+
+    def open_ledger_store(self, bank_name):
+        """Get the ledger store of a bank"""
+        raise NotImplementedError
+
+    @contextmanager
+    def transaction(self):
+        """Group the writes made in the with block into one atomic change"""
+        yield
+
+    def sync(self):
+        """Make everything written so far durable"""
+        self.account_store.sync()
+        for store in self.ledger_stores.values():
+            store.sync()
+
+    def close(self):
+        """Close all stores"""
+        self.account_store.close()
+        for store in self.ledger_stores.values():
+            store.close()
+
+class JSONStorageBackend(StorageBackend):
+    """
+    Accounts in users.json and merchants.json with a write-ahead log, and
+    blockchains in segmented JSON ledger files under blockchain_data.
+
+    Account log records and ledger records are synced separately, so a
+    crash can keep part of a payment's writes; each record holds absolute
+    state and recovery replays what was written.
+    """
+    name = "json"
+
+    def __init__(self, ledger_dir="blockchain_data"):
+        super().__init__()
+        self.ledger_dir = ledger_dir
+
+    def open_account_store(self):
+        """Get the account store"""
+        if self.account_store is None:
+            self.account_store = AccountStore()
+        return self.account_store
+
+    def open_ledger_store(self, bank_name):
+        """Get the ledger store of a bank"""
+        if bank_name not in self.ledger_stores:
+            self.ledger_stores[bank_name] = SegmentedLedgerStore(os.path.join(self.ledger_dir, bank_name))
+        return self.ledger_stores[bank_name]
+
+class SQLiteStorageBackend(StorageBackend):
+    """
+    Accounts, the MMID mapping and all blockchains in one SQLite database
+    in WAL mode. Transactions are indexed by ID, user, merchant and
+    timestamp in SQL, so lookups don't need in-memory indexes and only
+    the chain tip is decoded at startup.
+
+    A payment's balance changes and ledger records are committed in one
+    SQLite transaction. On first start the JSON account files and ledgers
+    are imported.
+    """
+    name = "sqlite"
+
+    def __init__(self, path="bank.db"):
+        super().__init__()
+        self.database = SQLiteDatabase(path)
+
+    def open_account_store(self):
+        """Get the account store"""
+        if self.account_store is None:
+            self.account_store = SQLiteAccountStore(self.database)
+        return self.account_store
+
+    def open_ledger_store(self, bank_name):
+        """Get the ledger store of a bank"""
+        if bank_name not in self.ledger_stores:
+            self.ledger_stores[bank_name] = SQLiteLedgerStore(self.database, bank_name)
+        return self.ledger_stores[bank_name]
+
+    def transaction(self):
+        """Group the writes made in the with block into one SQLite transaction"""
+        return self.database.transaction()
+
+    def sync(self):
+        """Commit everything written so far"""
+        self.database.sync()
+
+    def close(self):
+        """Commit and close the database"""
+        self.database.close()
+
+def create_storage_backend(settings):
+    """Create the storage backend named by the storage_backend bank setting"""
+    name = settings.get("storage_backend", JSONStorageBackend.name)
+    if name == SQLiteStorageBackend.name:
+        return SQLiteStorageBackend(settings.get("sqlite_path", "bank.db"))
+    if name == JSONStorageBackend.name:
+        return JSONStorageBackend()
+    raise ValueError(f"Unknown storage backend: {name}")
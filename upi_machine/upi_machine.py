@@ -2,7 +2,6 @@
 UPI Machine Implementation for UPI Payment Gateway System
 """
 
-import json
 import socket
 import threading
 import time
@@ -17,8 +16,9 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from common_utils import ( # type: ignore
     generate_qr_code, display_qr_code, SPECK,
     HOST, PORT_BANK, PORT_UPI_MACHINE, PORT_USER,
-    send_message
+    send_message, PAYMENT_RETRIES
 )
+from protocol import serve_connection # type: ignore
 
 class UPIMachine:
     """UPI Machine Implementation"""
@@ -88,7 +88,8 @@ class UPIMachine:
     
     def process_payment(self, payment_data):
         """Process payment from user"""
-        required_fields = ["vmid", "mmid", "amount", "pin"]
+        # The user is identified by a session token, or by MMID and PIN
+        required_fields = ["vmid", "amount"] if "token" in payment_data else ["vmid", "mmid", "amount", "pin"]
         for field in required_fields:
             if field not in payment_data:
                 return {"status": "error", "message": f"Missing required field: {field}"}
@@ -99,51 +100,36 @@ class UPIMachine:
         # Decode VMID to get merchant ID
         vmid = payment_data["vmid"]
         
-        # First, we need to determine which merchant this VMID belongs to
-        # In a real system, this would involve querying the bank or using a different mechanism
-        # For simplicity, we'll ask the bank to decode the VMID
-        # This would normally require more secure handling
-        
-        # For demo purposes, we'll try to decode with merchant IDs from the bank
-        merchant_list_response = send_message(HOST, PORT_BANK, {"type": "list_merchants"})
-        
-        if merchant_list_response["status"] != "success":
-            return {"status": "error", "message": "Could not retrieve merchant list"}
-        
-        merchants = merchant_list_response["merchants"]
-        decoded_mid = None
-        
-        # Try to decode VMID with each merchant ID
-        for mid in merchants:
-            decode_response = send_message(HOST, PORT_BANK, {
-                "type": "decode_vmid",
-                "vmid": vmid,
-                "mid": mid
-            })
-            
-            if decode_response["status"] == "success":
-                decoded_mid = mid
-                break
+        # Ask the bank which merchant this VMID belongs to
+        resolve_response = send_message(HOST, PORT_BANK, {
+            "type": "resolve_vmid",
+            "vmid": vmid
+        })
         
-        if not decoded_mid:
+        if resolve_response["status"] != "success":
             return {"status": "error", "message": "Could not decode VMID"}
         
+        decoded_mid = resolve_response["mid"]
+        
         # Process transaction with bank
         transaction_data = {
             "mid": decoded_mid,
-            "mmid": payment_data["mmid"],
-            "amount": payment_data["amount"],
-            "pin": payment_data["pin"]
+            "amount": payment_data["amount"]
         }
+        for field in ("token", "mmid", "pin", "idempotency_key"):
+            if field in payment_data:
+                transaction_data[field] = payment_data[field]
         
         # If quantum attack simulation is requested
         if "simulate_quantum_attack" in payment_data and payment_data["simulate_quantum_attack"]:
             transaction_data["simulate_quantum_attack"] = True
         
+        # With an idempotency key the bank won't charge twice, so a request
+        # that got no response can be retried
         transaction_response = send_message(HOST, PORT_BANK, {
             "type": "process_transaction",
             "data": transaction_data
-        })
+        }, retries=PAYMENT_RETRIES if "idempotency_key" in transaction_data else 0)
         
         # Clear current transaction
         self.current_transaction = None
@@ -151,40 +137,27 @@ class UPIMachine:
         # Return transaction response
         return transaction_response
     
+    def dispatch_request(self, request):
+        """Process a decoded request and return the response"""
+        response = {"status": "error", "message": "Unknown request type"}
+        
+        if "type" in request:
+            if request["type"] == "generate_qr":
+                response = self.generate_qr_code_for_merchant(request["mid"])
+            elif request["type"] == "process_payment":
+                response = self.process_payment(request["payment_data"])
+            elif request["type"] == "get_merchant_balance":
+                # Forward request to bank
+                response = send_message(HOST, PORT_BANK, {
+                    "type": "get_merchant_balance",
+                    "mid": request["mid"]
+                })
+        
+        return response
+    
     def handle_client(self, client_socket):
-        """Handle client connection"""
-        try:
-            # Receive data from client
-            data = client_socket.recv(4096).decode()
-            request = json.loads(data)
-            
-            # Process request
-            response = {"status": "error", "message": "Unknown request type"}
-            
-            if "type" in request:
-                if request["type"] == "generate_qr":
-                    response = self.generate_qr_code_for_merchant(request["mid"])
-                elif request["type"] == "process_payment":
-                    response = self.process_payment(request["payment_data"])
-                elif request["type"] == "get_merchant_balance":
-                    # Forward request to bank
-                    response = send_message(HOST, PORT_BANK, {
-                        "type": "get_merchant_balance",
-                        "mid": request["mid"]
-                    })
-            
-            # Send response
-            client_socket.sendall(json.dumps(response).encode())
-            
-        except Exception as e:
-            print(f"Error handling client: {e}")
-            try:
-                error_response = {"status": "error", "message": f"UPI Machine error: {str(e)}"}
-                client_socket.sendall(json.dumps(error_response).encode())
-            except:
-                pass
-        finally:
-            client_socket.close()
+        """Handle client connection, answering requests until the client disconnects"""
+        serve_connection(client_socket, self.dispatch_request, "UPI Machine error")
     
     def start_server(self):
         """Start the UPI machine server"""
@@ -2,12 +2,12 @@
 User Client Implementation for UPI Payment Gateway System
 """
 
-import json
 import socket
 import threading
 import time
 import os
 import sys
+import uuid
 from datetime import datetime
 
 # Add parent directory to path for imports
@@ -15,15 +15,21 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from common_utils import ( # type: ignore
     HOST, PORT_BANK, PORT_UPI_MACHINE, PORT_USER,
-    send_message
+    send_message, PAYMENT_RETRIES
 )
+from blockchain import verify_transaction_proof # type: ignore
+from protocol import serve_connection # type: ignore
 
 class UserClient:
     """User Client Implementation"""
     def __init__(self):
-        # User credentials
+        # Session issued by the bank at login; the PIN is not kept
         self.mmid = None
-        self.pin = None
+        self.token = None
+        
+        # transaction_id -> (amount, per-bank receipts) of payments made
+        # here, the trusted reference for verify_transaction()
+        self.receipts = {}
         
         # Initialize server socket
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -40,16 +46,16 @@ class UserClient:
     
     def login(self, mmid, pin):
         """Login user with MMID and PIN"""
-        # Verify credentials with bank
+        # Verify credentials with bank and start a session
         response = send_message(HOST, PORT_BANK, {
-            "type": "get_user_balance",
+            "type": "login",
             "mmid": mmid,
             "pin": pin
         })
         
         if response["status"] == "success":
             self.mmid = mmid
-            self.pin = pin
+            self.token = response["token"]
             return {
                 "status": "success",
                 "message": "Login successful",
@@ -63,24 +69,39 @@ class UserClient:
     
     def logout(self):
         """Logout user"""
+        if self.token:
+            try:
+                send_message(HOST, PORT_BANK, {"type": "logout", "token": self.token})
+            except Exception as e:
+                print(f"Error ending session: {e}")
+        
         self.mmid = None
-        self.pin = None
+        self.token = None
         return {
             "status": "success",
             "message": "Logout successful"
         }
     
+    def _check_session(self, response):
+        """Forget the session if the bank no longer accepts it, so the user is asked to log in again"""
+        if response.get("session_expired"):
+            self.mmid = None
+            self.token = None
+            return {"status": "error", "message": "Session expired, please log in again"}
+        return response
+    
     def scan_qr_code(self, qr_data, amount, simulate_quantum_attack=False):
         """Process payment by scanning QR code"""
-        if not self.mmid or not self.pin:
+        if not self.token:
             return {"status": "error", "message": "User not logged in"}
         
-        # QR data contains VMID
+        # QR data contains VMID; the idempotency key lets the payment be
+        # retried without paying twice
         payment_data = {
             "vmid": qr_data,
-            "mmid": self.mmid,
-            "pin": self.pin,
-            "amount": amount
+            "token": self.token,
+            "amount": amount,
+            "idempotency_key": uuid.uuid4().hex
         }
         
         if simulate_quantum_attack:
@@ -90,73 +111,110 @@ class UserClient:
         response = send_message(HOST, PORT_UPI_MACHINE, {
             "type": "process_payment",
             "payment_data": payment_data
-        })
+        }, retries=PAYMENT_RETRIES)
+        
+        response = self._check_session(response)
+        if response["status"] == "success":
+            self.receipts[response["transaction_id"]] = (response["amount"], response.get("receipts", {}))
         
         return response
     
     def check_balance(self):
         """Check user balance"""
-        if not self.mmid or not self.pin:
+        if not self.token:
             return {"status": "error", "message": "User not logged in"}
         
         # Send balance request to bank
         response = send_message(HOST, PORT_BANK, {
             "type": "get_user_balance",
-            "mmid": self.mmid,
-            "pin": self.pin
+            "token": self.token
         })
         
-        return response
+        return self._check_session(response)
     
     def view_transactions(self):
         """View user transactions"""
-        if not self.mmid or not self.pin:
+        if not self.token:
             return {"status": "error", "message": "User not logged in"}
         
         # Send transactions request to bank
         response = send_message(HOST, PORT_BANK, {
             "type": "get_user_transactions",
-            "mmid": self.mmid,
-            "pin": self.pin
+            "token": self.token
+        })
+        
+        return self._check_session(response)
+    
+    def verify_transaction(self, transaction_id):
+        """
+        Verify locally that a transaction is included in the bank's ledger
+        
+        The proof must be for the requested transaction and hash up to its
+        block hash. For a payment made from this client the amount must
+        match, and if the payment receipt had a block hash the proof must
+        be for that same block ("anchored"). Without a receipt block hash
+        the proof only shows that the bank's answer is consistent.
+        """
+        if not self.token:
+            return {"status": "error", "message": "User not logged in"}
+        
+        amount, receipts = self.receipts.get(transaction_id, (None, {}))
+        trusted_bank = next((bank for bank, receipt in receipts.items() if "block_hash" in receipt), None)
+        
+        # Only the transaction's Merkle path and block header are downloaded
+        response = send_message(HOST, PORT_BANK, {
+            "type": "get_transaction_proof",
+            "transaction_id": transaction_id,
+            "bank": trusted_bank
         })
         
+        if response["status"] != "success":
+            return response
+        
+        proof = response["proof"]
+        transaction = proof["transaction"]
+        verified = (verify_transaction_proof(proof) and
+                    transaction.get("transaction_id") == transaction_id)
+        if amount is not None:
+            verified = verified and transaction.get("amount") == amount
+        if trusted_bank is not None:
+            receipt = receipts[trusted_bank]
+            verified = (verified and proof["block_hash"] == receipt["block_hash"] and
+                        proof["header"]["index"] == receipt["block_index"])
+        
+        return {
+            "status": "success",
+            "verified": verified,
+            "anchored": trusted_bank is not None,
+            "bank": response["bank"],
+            "block_index": proof["header"]["index"],
+            "block_hash": proof["block_hash"]
+        }
+    
+    def dispatch_request(self, request):
+        """Process a decoded request and return the response"""
+        response = {"status": "error", "message": "Unknown request type"}
+        
+        if "type" in request:
+            if request["type"] == "login":
+                response = self.login(request["mmid"], request["pin"])
+            elif request["type"] == "logout":
+                response = self.logout()
+            elif request["type"] == "scan_qr":
+                response = self.scan_qr_code(request["qr_data"], request["amount"], 
+                                           request.get("simulate_quantum_attack", False))
+            elif request["type"] == "check_balance":
+                response = self.check_balance()
+            elif request["type"] == "view_transactions":
+                response = self.view_transactions()
+            elif request["type"] == "verify_transaction":
+                response = self.verify_transaction(request["transaction_id"])
+        
         return response
     
     def handle_client(self, client_socket):
-        """Handle client connection"""
-        try:
-            # Receive data from client
-            data = client_socket.recv(4096).decode()
-            request = json.loads(data)
-            
-            # Process request
-            response = {"status": "error", "message": "Unknown request type"}
-            
-            if "type" in request:
-                if request["type"] == "login":
-                    response = self.login(request["mmid"], request["pin"])
-                elif request["type"] == "logout":
-                    response = self.logout()
-                elif request["type"] == "scan_qr":
-                    response = self.scan_qr_code(request["qr_data"], request["amount"], 
-                                               request.get("simulate_quantum_attack", False))
-                elif request["type"] == "check_balance":
-                    response = self.check_balance()
-                elif request["type"] == "view_transactions":
-                    response = self.view_transactions()
-            
-            # Send response
-            client_socket.sendall(json.dumps(response).encode())
-            
-        except Exception as e:
-            print(f"Error handling client: {e}")
-            try:
-                error_response = {"status": "error", "message": f"User Client error: {str(e)}"}
-                client_socket.sendall(json.dumps(error_response).encode())
-            except:
-                pass
-        finally:
-            client_socket.close()
+        """Handle client connection, answering requests until the client disconnects"""
+        serve_connection(client_socket, self.dispatch_request, "User Client error")
     
     def start_server(self):
         """Start the user client server"""
@@ -179,15 +237,16 @@ class UserClient:
     def start(self):
         """Start the user client UI"""
         while True:
-            if self.mmid and self.pin:
+            if self.token:
                 print(f"\n===== UPI User Client (Logged in as MMID: {self.mmid}) =====")
                 print("1. Scan QR Code & Pay")
                 print("2. Check Balance")
                 print("3. View Transaction History")
-                print("4. Logout")
-                print("5. Exit")
+                print("4. Verify Transaction")
+                print("5. Logout")
+                print("6. Exit")
                 
-                choice = input("Enter your choice (1-5): ")
+                choice = input("Enter your choice (1-6): ")
                 
                 if choice == "1":
                     self.scan_qr_ui()
@@ -196,9 +255,11 @@ class UserClient:
                 elif choice == "3":
                     self.view_transactions_ui()
                 elif choice == "4":
+                    self.verify_transaction_ui()
+                elif choice == "5":
                     self.logout()
                     print("Logged out successfully.")
-                elif choice == "5":
+                elif choice == "6":
                     print("Exiting User Client...")
                     break
                 else:
@@ -303,6 +364,29 @@ class UserClient:
                 print(f"Date: {datetime.fromtimestamp(transaction['timestamp']).strftime('%Y-%m-%d %H:%M:%S')}")
         else:
             print(f"Error: {result['message']}")
+    
+    def verify_transaction_ui(self):
+        """UI for verifying a transaction against the ledger"""
+        print("\n----- Verify Transaction -----")
+        
+        transaction_id = input("Enter Transaction ID: ")
+        if not transaction_id:
+            print("Transaction ID cannot be empty.")
+            return
+        
+        result = self.verify_transaction(transaction_id)
+        
+        if result["status"] == "success":
+            if result["verified"]:
+                print(f"Transaction verified in {result['bank']} ledger block #{result['block_index']}")
+                print(f"Block Hash: {result['block_hash']}")
+                if not result["anchored"]:
+                    print("Note: no block hash from a payment receipt to compare with, "
+                          "so this only shows the bank's answer is self-consistent.")
+            else:
+                print("VERIFICATION FAILED - the proof does not match the ledger block!")
+        else:
+            print(f"Error: {result['message']}")
 
 
 if __name__ == "__main__":